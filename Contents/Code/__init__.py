@@ -18,41 +18,864 @@ Python Version: 2.7
 # Import required modules
 
 import re
+import time
 import datetime
 import random
+import collections
 import urllib2
 
-
-# Preferences
+try:
+    from lxml import etree
+    def CompileXPath(expression):
+        return etree.XPath(expression)
+except ImportError:
+    # Fall back to evaluating the expression string on each call
+    def CompileXPath(expression):
+        return lambda element: element.xpath(expression)
+
+
+# Compiled patterns: every regex and XPath the agent evaluates, compiled once at import
+
+# File names and titles
+SPECIAL_TAG = re.compile(r'{(tmdb-|imdb-|ade-(\d+))}')
+TITLE_YEAR = re.compile(r'[^\\]*\\([^\\]+) \((\d{4})\)(?: - ?(?:cd|disc|disk|dvd|part|pt)\d+)?(?: \{[^}]*\})?\.([^.]+)$')
+TRAILING_YEAR = re.compile(r"\s*\(\d{4}\)\s*$")
+YEAR = re.compile(r'\d{4}')
+TITLE_TOKENS = re.compile(r'[a-z0-9]+')
+PERFORMER_ID = re.compile(r'/(\d+)h?\.jpg', re.IGNORECASE)
+GALLERY_SIZE = re.compile(r'(\d+)')
+
+# Search result pages, matched on the decoded page text to split it into rows
+SEARCH_ROW_START = re.compile(r'<div\s[^>]*class="[^"]*row list-view-item')
+SEARCH_PAGE_LINK = re.compile(r'[?&;]page=(\d+)')
+SEARCH_ROWS = CompileXPath('//div[contains(@class,"row list-view-item")]')
+ROW_TITLE = CompileXPath('.//a[contains(@label,"Title")]')
+ROW_DVD = CompileXPath('.//a[@title="DVD" or @title="dvd"]')
+ROW_PRODUCTION_YEAR = CompileXPath('.//a[contains(@aria-label, "View")]/following-sibling::text()[1]')
+ROW_RELEASE_YEAR = CompileXPath('.//small[contains(text(),"released")]/following-sibling::text()')
+
+# Movie detail and gallery pages: DETAIL_NODES selects every node parse_details needs in one document
+# scan, in document order
+DETAIL_NODES = CompileXPath(
+    '//h1'
+    ' | //h2[contains(@class, "test")]'
+    ' | //span[@class="rating-stars-avg"]'
+    ' | //div[@class="synopsis-content"]/p'
+    ' | //link[@rel="image_src"]'
+    ' | //li[small]'
+    ' | //div[@class="hover-popover-detail"]/img'
+    ' | //a[@label or @rel or contains(@href, "/gallery")]')
+TEXT_NODES = CompileXPath('text()')
+LABEL_NODES = CompileXPath('small/text()')
+LABEL_VALUE_NODES = CompileXPath('small/following-sibling::text()')
+LABEL_LINK_NODES = CompileXPath('small/following-sibling::a/text()')
+GENRE_LIST = CompileXPath('ancestor::ul[@class="list-unstyled m-b-2"]')
+GALLERY_IMAGES = CompileXPath('//div/a[contains(@class, "thumb fancy")]')
+
+
+# Preferences: parsed once into an immutable SETTINGS snapshot, replaced as a whole by ValidatePrefs
 preference = Prefs
-DEBUG = preference['debug']
-
-def LogDebug(message):
-    if DEBUG:
-        Log('[DEBUG] {0}'.format(message))
-
-LogDebug('Agent debug logging is enabled!' if DEBUG else 'Agent debug logging is disabled!')
-studioascollection = preference['studioascollection']
-useproductiondate = preference['useproductiondate']
-searchtype = preference['searchtype'] if preference['searchtype'] != 'all' else 'allsearch'
-LogDebug('Search Type: {0}'.format(searchtype))
-
-GOOD_SCORE = max(int(preference['goodscore'].strip()), 1)
-LogDebug('Good Score Threshold: {0}'.format(GOOD_SCORE))
 INITIAL_SCORE = 100
-
 ADE_BASEURL = 'http://www.adultdvdempire.com'
-ADE_SEARCH_MOVIES = ADE_BASEURL + '/' + searchtype + '/search?view=list&q=%s'
 ADE_MOVIE_INFO = ADE_BASEURL + '/%s/'
+ADE_SEARCH = ADE_BASEURL + '/{0}/search?view=list&q=%s'
+SEARCH_FORMATS = ('dvd', 'bluray', 'vod')  # Searched one by one when splitsearch is on, rows merged in this order
+# The format of every row in a single format's listing; only a 'DVD' row halves a 'VOD' one
+SEARCH_ROW_FORMATS = {'dvd': 'DVD', 'bluray': 'bluray', 'vod': 'VOD'}
+
+Settings = collections.namedtuple('Settings', [
+    'debug', 'search_urls', 'good_score', 'score_bound', 'use_production_date',
+    'studio_as_collection', 'ignore_genres', 'pull_screens', 'screens_count', 'pull_gallery',
+    'gallery_count', 'image_selection', 'max_art', 'request_rate', 'cache_days', 'cache_size',
+    'search_cache_hours', 'local_match', 'skip_unchanged', 'metrics_interval', 'metrics_file',
+    'prefetch_count', 'fingerprint'])
+
+def NumberPref(key, default, minimum, convert=int):
+    # Plex saves a bad value before ValidatePrefs sees it, so it falls back to the DefaultPrefs.json
+    # value here rather than stop the agent from loading on the next start
+    try:
+        value = convert(preference[key].strip())
+    except Exception:
+        Log('Invalid value for preference {0}: {1!r}, using {2}'.format(key, preference[key], default))
+        value = default
+    return max(value, minimum)
+
+def LoadSettings():
+    # Reads every preference the agent uses, converted to the form the code compares against
+    search_type = preference['searchtype'] if preference['searchtype'] != 'all' else 'allsearch'
+    search_types = (search_type,)
+    if search_type == 'allsearch' and preference['splitsearch']:
+        search_types = SEARCH_FORMATS
+    good_score = NumberPref('goodscore', 98, 1)
+    settings = dict(
+        debug=preference['debug'],
+        search_urls=tuple((search_type, ADE_SEARCH.format(search_type)) for search_type in search_types),
+        good_score=good_score,
+        score_bound=max(INITIAL_SCORE - good_score, 0),  # Most edits a title can be away and still score good_score
+        use_production_date=preference['useproductiondate'],
+        studio_as_collection=preference['studioascollection'],
+        ignore_genres=frozenset(genre.lower() for genre in (preference['ignoregenres'] or '').split('|')),
+        pull_screens=preference['pullscreens'],
+        screens_count=NumberPref('pullscreenscount', 3, 0),
+        pull_gallery=preference['pullgallery'],
+        gallery_count=NumberPref('pullgallerycount', 3, 0),
+        image_selection=preference['imageselection'],
+        max_art=NumberPref('maxart', 0, 0),
+        request_rate=NumberPref('requestrate', 5.0, 0, float),  # Requests per second per host, 0 for no limit
+        cache_days=NumberPref('cachedays', 30, 0),
+        cache_size=NumberPref('cachesize', 50000, 1),
+        search_cache_hours=NumberPref('searchcachehours', 24, 0),
+        local_match=preference['localmatch'],
+        skip_unchanged=preference['skipunchanged'],
+        metrics_interval=NumberPref('metricsinterval', 10, 0),
+        metrics_file=preference['metricsfile'],
+        prefetch_count=NumberPref('prefetch', 1, 0),
+    )
+    # The settings that shape what update() writes, see UpdateContext
+    settings['fingerprint'] = repr([settings[key] for key in FINGERPRINT_SETTINGS])
+    return Settings(**settings)
+
+FINGERPRINT_SETTINGS = ('use_production_date', 'ignore_genres', 'pull_screens', 'screens_count', 'pull_gallery',
+                        'gallery_count', 'image_selection', 'max_art', 'studio_as_collection')
+SETTINGS = LoadSettings()
+
+def LogDebug(message, *args):
+    # Arguments are only formatted into message when debug logging is on, so pass them separately
+    # instead of calling format() at the call site
+    if SETTINGS.debug:
+        Log('[DEBUG] {0}'.format(message.format(*args) if args else message))
+
+# Metrics: per-phase timings and counters, summarized in the log every metrics_interval minutes
+METRICS_DATA_ITEM = 'metrics.json'
+METRICS_IDLE_CHECK = 10  # Minutes between checks for metrics being turned on while they are off
+
+class Metrics(object):
+    # Thread-safe timings (count, total and max seconds per phase) and counters, kept for the
+    # current reporting window and since the agent started
+
+    def __init__(self):
+        self.lock = Thread.Lock()
+        self.started = time.time()
+        self.window_started = self.started
+        self.window = ({}, {})
+        self.totals = ({}, {})
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            for timings, counters in (self.window, self.totals):
+                timing = timings.setdefault(phase, [0, 0.0, 0.0])
+                timing[0] += 1
+                timing[1] += seconds
+                timing[2] = max(timing[2], seconds)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            for timings, counters in (self.window, self.totals):
+                counters[name] = counters.get(name, 0) + amount
+
+    def timer(self, phase):
+        return PhaseTimer(self, phase)
+
+    def describe(self, timings, counters):
+        parts = []
+        for phase in sorted(timings):
+            count, total, longest = timings[phase]
+            parts.append('{0} {1}x avg {2:.0f}ms max {3:.0f}ms'.format(phase, count, total * 1000 / count, longest * 1000))
+        for name in sorted(counters):
+            parts.append('{0} {1}'.format(name, counters[name]))
+        return '; '.join(parts)
+
+    def snapshot(self, timings, counters):
+        return {
+            'timings': dict((phase, {'count': t[0], 'total': round(t[1], 4), 'max': round(t[2], 4)}) for phase, t in timings.items()),
+            'counters': dict(counters),
+        }
+
+    def report(self):
+        with self.lock:
+            now = time.time()
+            timings, counters = self.window
+            window = (self.snapshot(timings, counters), self.describe(timings, counters), now - self.window_started)
+            totals = self.snapshot(*self.totals)
+            self.window = ({}, {})
+            self.window_started = now
+        if window[1]:
+            Log('Metrics for the last {0:.0f}s: {1}'.format(window[2], window[1]))
+        if SETTINGS.metrics_file:
+            stats = {'updated': now, 'started': self.started, 'window': window[0], 'window_seconds': round(window[2], 1), 'totals': totals}
+            try:
+                Data.Save(METRICS_DATA_ITEM, JSON.StringFromObject(stats))
+            except Exception as e:
+                LogDebug('Failed to write metrics file: {0}', e)
+
+class PhaseTimer(object):
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_time(self.phase, time.time() - self.started)
+        return False
+
+METRICS = Metrics()
+
+def Timed(phase):
+    # Decorator recording every call of the wrapped function under phase
+    def decorator(function):
+        def timed(*args, **kwargs):
+            with METRICS.timer(phase):
+                return function(*args, **kwargs)
+        timed.__name__ = function.__name__
+        timed.__doc__ = function.__doc__
+        return timed
+    return decorator
+
+def ReportMetrics():
+    interval = SETTINGS.metrics_interval
+    if interval:
+        METRICS.report()
+    Thread.CreateTimer((interval or METRICS_IDLE_CHECK) * 60, ReportMetrics)
+
+# Request client: every ADE page and image request goes through FetchURL
+REQUEST_BURST = 4
+REQUEST_TIMEOUT = 20
+REQUEST_RETRIES = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+class TokenBucket(object):
+    # Allows rate acquisitions per second on average, with bursts of up to burst
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.lock = Thread.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            Thread.Sleep(wait)
+
+REQUEST_BUCKETS = {}
+REQUEST_BUCKETS_LOCK = Thread.Lock()
+
+def HostBucket(url):
+    host = url.split('/')[2] if '://' in url else ''
+    with REQUEST_BUCKETS_LOCK:
+        if host not in REQUEST_BUCKETS:
+            REQUEST_BUCKETS[host] = TokenBucket(SETTINGS.request_rate, REQUEST_BURST)
+        return REQUEST_BUCKETS[host]
+
+def RetryDelay(attempt, error):
+    # Honours Retry-After on a 429/503, otherwise full-jitter exponential backoff
+    headers = getattr(error, 'hdrs', None) or getattr(error, 'headers', None)
+    retry_after = headers.get('Retry-After') if headers is not None else None
+    if retry_after and retry_after.strip().isdigit():
+        return min(float(retry_after), RETRY_MAX_DELAY)
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+def FetchURL(url, headers=None, timeout=REQUEST_TIMEOUT, deadline=None, slot=None):
+    # Requests url held to the host's requestrate, retrying 429/5xx responses and connection errors
+    # with jittered backoff. No retry starts after deadline, and slot is only held while a request is in flight.
+    attempt = 0
+    while True:
+        if deadline is not None:
+            timeout = max(min(timeout, deadline - time.time()), 1)
+        if slot is not None:
+            slot.acquire()
+        try:
+            if SETTINGS.request_rate:
+                HostBucket(url).acquire()
+            with METRICS.timer('fetch'):
+                response = HTTP.Request(url, headers=headers or {}, timeout=timeout)
+                content = response.content  # Load the body here so a failure mid-transfer is retried too
+            METRICS.count('requests')
+            METRICS.count('bytes', len(content))
+            return response
+        except urllib2.HTTPError as e:
+            if (e.code != 429 and e.code < 500) or attempt >= REQUEST_RETRIES:
+                raise
+            error = e
+        except (urllib2.URLError, IOError) as e:
+            if attempt >= REQUEST_RETRIES:
+                raise
+            error = e
+        finally:
+            if slot is not None:
+                slot.release()
+        delay = RetryDelay(attempt, error)
+        if deadline is not None and time.time() + delay >= deadline:
+            raise error
+        attempt += 1
+        METRICS.count('retries')
+        LogDebug('Request for {0} failed ({1}), retry {2} in {3:.1f}s', url, getattr(error, 'code', error), attempt, delay)
+        Thread.Sleep(delay)
+
+def FetchPage(url):
+    # Returns the parsed HTML of a page fetched through FetchURL
+    return ParsePage(FetchURL(url).content)
+
+def ParsePage(content):
+    with METRICS.timer('parse.html'):
+        return HTML.ElementFromString(content)
+
+# Detail cache: parsed movie pages are kept for cachedays, at most cachesize of them
+
+class PersistentCache(object):
+    # Size-bounded LRU cache persisted through Data, one (stored_at, value) item per entry, with
+    # the TTL/LRU index in Dict and optionally the most recent memory_items values in process
+
+    def __init__(self, name, ttl, max_items, memory_items=0):
+        self.name = name
+        self.ttl = ttl
+        self.max_items = max_items
+        self.memory_items = memory_items
+        self.memory = collections.OrderedDict()
+        self.lock = Thread.Lock()
+
+    def data_key(self, key):
+        return '{0}-{1}'.format(self.name, key)
+
+    def index(self):
+        if self.name not in Dict:
+            Dict[self.name] = {}
+        return Dict[self.name]
+
+    def get(self, key):
+        if self.ttl <= 0:
+            return None
+        value = self.lookup(str(key))
+        METRICS.count('{0}.{1}'.format(self.name, 'miss' if value is None else 'hit'))
+        return value
+
+    def lookup(self, key):
+        now = time.time()
+        with self.lock:
+            index = self.index()
+            entry = index.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                self.remove_entry(index, key)
+                Dict[self.name] = index
+                return None
+            if entry is not None and key in self.memory:
+                entry[1] = now
+                value = self.memory.pop(key)
+                self.memory[key] = value
+                return value
+
+        # Data is the source of truth: entries missing from the index (e.g. written by
+        # Tools/bulkimport.py) are adopted when they are still fresh
+        if not Data.Exists(self.data_key(key)):
+            if entry is not None:
+                self.remove(key)
+            return None
+        try:
+            stored_at, value = Data.LoadObject(self.data_key(key))
+        except Exception as e:
+            LogDebug('Failed to load cache entry {0}: {1}', self.data_key(key), e)
+            return None
+        if now - stored_at > self.ttl:
+            self.remove(key)
+            return None
+        with self.lock:
+            index = self.index()
+            index[key] = [stored_at, now]
+            if entry is None:
+                if len(index) > self.max_items:
+                    self.evict(index)
+                Dict[self.name] = index
+        self.remember(key, value)
+        return value
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        key = str(key)
+        with self.lock:
+            index = self.index()
+            now = time.time()
+            Data.SaveObject(self.data_key(key), (now, value))
+            index[key] = [now, now]
+            if len(index) > self.max_items:
+                self.evict(index)
+            Dict[self.name] = index  # Reassign so the framework persists the index
+        self.remember(key, value)
+
+    def remember(self, key, value):
+        if self.memory_items <= 0:
+            return
+        with self.lock:
+            self.memory.pop(key, None)
+            self.memory[key] = value
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def remove(self, key):
+        key = str(key)
+        with self.lock:
+            index = self.index()
+            self.remove_entry(index, key)
+            Dict[self.name] = index
+
+    def remove_entry(self, index, key):
+        index.pop(key, None)
+        self.memory.pop(key, None)
+        if Data.Exists(self.data_key(key)):
+            Data.Remove(self.data_key(key))
+
+    def evict(self, index):
+        # Evict down to 90% of capacity so a full cache doesn't sort on every write
+        overflow = len(index) - int(self.max_items * 0.9)
+        oldest = sorted(index.items(), key=lambda item: item[1][1])[:overflow]
+        for key, entry in oldest:
+            self.remove_entry(index, key)
+        LogDebug('Evicted {0} entries from {1}', len(oldest), self.name)
+
+class SingleFlight(object):
+    # Collapses concurrent calls for the same key into one that every caller shares the result of
+
+    def __init__(self):
+        self.lock = Thread.Lock()
+        self.calls = {}
+
+    def do(self, key, function, *args):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {'event': Thread.Event(), 'result': None, 'error': None}
+                self.calls[key] = call
+        if not leader:
+            LogDebug('Waiting on in-flight request for: {0}', key)
+            call['event'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = function(*args)
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call['event'].set()
+        return call['result']
+
+DETAIL_CACHE = PersistentCache('detailcache', SETTINGS.cache_days * 86400, SETTINGS.cache_size)
+
+# Detail prefetch: pages of likely search winners are downloaded into DETAIL_CACHE in the background
+# while Plex moves from search() to update()
+PREFETCH_WORKERS = 2
+PREFETCH_QUEUE = 20  # Oldest queued prefetches are dropped beyond this
+PREFETCH_WAIT = 20  # Seconds update() waits for an in-flight prefetch of its own page
+
+class Prefetcher(object):
+    # Bounded background queue of ADE ids to fetch, at most workers at a time. claim() takes an id
+    # off the queue (or waits for its fetch) and cancels the rest of the batch it was queued with.
+
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.lock = Thread.Lock()
+        self.pending = collections.OrderedDict()  # ade_id -> (batch, function), in queue order
+        self.running = {}  # ade_id -> (batch, Event)
+        self.active = 0
+
+    def add(self, ade_ids, function):
+        batch = object()
+        with self.lock:
+            for ade_id in ade_ids:
+                if ade_id not in self.pending and ade_id not in self.running:
+                    self.pending[ade_id] = (batch, function)
+            while len(self.pending) > self.queue_limit:
+                self.pending.popitem(last=False)
+                METRICS.count('prefetch.dropped')
+            start = min(self.workers - self.active, len(self.pending))
+            self.active += start
+        for i in range(start):
+            Thread.Create(self.worker)
+
+    def worker(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.active -= 1
+                    return
+                ade_id, (batch, function) = self.pending.popitem(last=False)
+                done = Thread.Event()
+                self.running[ade_id] = (batch, done)
+            try:
+                function(ade_id)
+                METRICS.count('prefetch.fetched')
+            except Exception as e:
+                LogDebug('Prefetch failed for ID {0}: {1}', ade_id, e)
+            finally:
+                with self.lock:
+                    del self.running[ade_id]
+                done.set()
+
+    def claim(self, ade_id, timeout):
+        with self.lock:
+            batch, done = self.pending.pop(ade_id, (None, None))[0], None
+            if ade_id in self.running:
+                batch, done = self.running[ade_id]
+            if batch is not None:
+                for other in [key for key, value in self.pending.items() if value[0] is batch]:
+                    del self.pending[other]
+                    METRICS.count('prefetch.cancelled')
+        if done is not None:
+            LogDebug('Waiting on prefetch of ID: {0}', ade_id)
+            done.wait(timeout)
+
+PREFETCHER = Prefetcher(PREFETCH_WORKERS, PREFETCH_QUEUE)
+DETAIL_FLIGHTS = SingleFlight()
+
+# Search cache: parsed search page rows keyed by normalized title and search type
+SEARCH_CACHE = PersistentCache('searchcache', SETTINGS.search_cache_hours * 3600, SETTINGS.cache_size, memory_items=500)
+SEARCH_FLIGHTS = SingleFlight()
+SEARCH_MAX_PAGES = 3  # Result pages followed when no row on the earlier ones reaches the good score
+
+# Refresh fingerprints: what the last update wrote for each ADE id, so an unchanged title is skipped
+FINGERPRINT_DAYS = 365
+FINGERPRINT_VERSION = 1  # Bump when update() writes something new, so every title is written again
+FINGERPRINTS = PersistentCache('fingerprints', FINGERPRINT_DAYS * 86400 if SETTINGS.skip_unchanged else 0, SETTINGS.cache_size)
+
+def DetailsFingerprint(details):
+    # Hash of the page content update() writes from; the lazily fetched gallery, and the image
+    # validators details cached by earlier versions hold, are left out as they change without the page
+    fields = sorted((key, value) for key, value in details.items() if key not in ('gallery', 'images'))
+    return Hash.MD5(repr(fields))
+
+def UpdateContext(title):
+    # Everything besides the page that decides what update() writes
+    return Hash.MD5(repr([FINGERPRINT_VERSION, title, SETTINGS.fingerprint]))
+
+# Titles whose linked gallery turned out to be missing or empty, so it is not requested again
+NO_GALLERY_DAYS = 90
+NO_GALLERY = PersistentCache('nogallery', NO_GALLERY_DAYS * 86400, SETTINGS.cache_size)
+
+# ETag, Last-Modified and content hash of downloaded images, by the MD5 of their URL. Kept apart from
+# the detail cache and well past IMAGE_REVALIDATE, so attached images are rechecked conditionally
+# instead of losing their validators whenever the movie's details expire
+IMAGE_VALIDATOR_DAYS = 90
+IMAGE_VALIDATORS = PersistentCache('imagevalidators', IMAGE_VALIDATOR_DAYS * 86400, SETTINGS.cache_size)
+
+# Performer cache: one canonical photo URL per performer, shared by every title they appear in
+PERFORMER_CACHE = PersistentCache('performers', SETTINGS.cache_days * 86400, SETTINGS.cache_size, memory_items=2000)
+
+def PerformerPhoto(name, src):
+    # Full-size photo URL for a cast thumbnail; the first URL seen for a performer (by ADE id, or
+    # name) is kept so every title links the same photo
+    match = PERFORMER_ID.search(src or '')
+    key = match.group(1) if match else Hash.MD5(name.lower())
+    performer = PERFORMER_CACHE.get(key)
+    if performer is None:
+        performer = {'name': name, 'photo': src.split('?')[0].replace("h.jpg", ".jpg") if src else None}
+        PERFORMER_CACHE.set(key, performer)
+    return performer['photo']
+
+# Local title index: every ADE title seen in searches and updates, consulted before searching ADE
+INDEX_SAVE_DELAY = 30  # Seconds to batch index changes before writing them to disk
+
+class TitleIndex(object):
+    # Token index over every title the agent has seen, persisted as one Data item. Entries are search
+    # rows (plus studio) so search() scores them like live rows.
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = Thread.Lock()
+        self.entries = None
+        self.postings = {}
+        self.save_pending = False
+
+    def tokens(self, title):
+        # Single letters (the s of "cat's") and "the" would pull in most of the library
+        return set(token for token in TITLE_TOKENS.findall(title.lower()) if token != 'the' and (len(token) > 1 or token.isdigit()))
+
+    def load(self):
+        # Callers hold self.lock
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            if Data.Exists(self.name):
+                self.entries = Data.LoadObject(self.name)
+        except Exception as e:
+            LogDebug('Failed to load title index: {0}', e)
+        for movie_id, entry in self.entries.items():
+            self.post(movie_id, entry[0][0])
+        LogDebug('Title index loaded with {0} titles.', len(self.entries))
+
+    def post(self, movie_id, title):
+        for token in self.tokens(title):
+            self.postings.setdefault(token, set()).add(movie_id)
+
+    def unpost(self, movie_id, title):
+        for token in self.tokens(title):
+            ids = self.postings.get(token)
+            if ids is not None:
+                ids.discard(movie_id)
+                if not ids:
+                    del self.postings[token]
+
+    def put(self, candidate, studio):
+        # Callers hold self.lock
+        movie_id = candidate[1]
+        existing = self.entries.get(movie_id)
+        if existing is not None:
+            if studio is None:
+                studio = existing[1]
+            if existing == (candidate, studio):
+                return False
+            self.unpost(movie_id, existing[0][0])
+        self.entries[movie_id] = (candidate, studio)
+        self.post(movie_id, candidate[0])
+        return True
+
+    def add_candidates(self, candidates):
+        with self.lock:
+            self.load()
+            changed = False
+            for candidate in candidates:
+                changed = self.put(tuple(candidate), None) or changed
+            if changed:
+                self.schedule_save()
+
+    def add_details(self, movie_id, details):
+        # Updates the studio of a known title, or adds one first seen through update()
+        with self.lock:
+            self.load()
+            existing = self.entries.get(movie_id)
+            if existing is not None:
+                candidate = existing[0]
+            elif details.get('title'):
+                title = details['title']
+                if title.endswith(', The'):
+                    title = 'The ' + title[:-5]
+                production_year = details['production_year']
+                production_year = int(production_year) if production_year and production_year.isdigit() else None
+                release_year = YEAR.search(details['released'] or '')
+                release_year = int(release_year.group()) if release_year else None
+                candidate = (title, movie_id, None, production_year, release_year)  # Format isn't on the detail page
+            else:
+                return
+            if self.put(candidate, details.get('studio')):
+                self.schedule_save()
+
+    def lookup(self, title):
+        # Returns the rows of every known title sharing a token with title
+        with self.lock:
+            self.load()
+            ids = set()
+            for token in self.tokens(title):
+                ids.update(self.postings.get(token, ()))
+            return [self.entries[movie_id][0] for movie_id in sorted(ids)]
+
+    def schedule_save(self):
+        # Callers hold self.lock
+        if not self.save_pending:
+            self.save_pending = True
+            Thread.CreateTimer(INDEX_SAVE_DELAY, self.save)
+
+    def save(self):
+        with self.lock:
+            self.save_pending = False
+            entries = dict(self.entries)
+        Data.SaveObject(self.name, entries)
+        LogDebug('Title index saved with {0} titles.', len(entries))
+
+TITLE_INDEX = TitleIndex('titleindex')
+
+# Image downloads: bounded worker pool, per-host concurrency cap and a deadline for each update
+IMAGE_WORKERS = 6
+IMAGE_HOST_LIMIT = 3
+IMAGE_DEADLINE = 30
+IMAGE_REVALIDATE = 30 * 86400  # Images already attached are rechecked against ADE at most this often
+IMAGE_HOST_SEMAPHORES = {}
+IMAGE_HOST_LOCK = Thread.Lock()
+
+def HostSemaphore(url):
+    # Shared across updates so concurrent refreshes together stay under IMAGE_HOST_LIMIT per host
+    host = url.split('/')[2] if '://' in url else ''
+    with IMAGE_HOST_LOCK:
+        if host not in IMAGE_HOST_SEMAPHORES:
+            IMAGE_HOST_SEMAPHORES[host] = Thread.Semaphore(limit=IMAGE_HOST_LIMIT)
+        return IMAGE_HOST_SEMAPHORES[host]
+
+def SelectImages(urls, count, seed):
+    # Chooses up to count of urls per the imageselection preference; 'stable' and 'spaced' pick the
+    # same images on every refresh, 'random' a fresh sample
+    if count <= 0 or not urls:
+        return []
+    if count >= len(urls):
+        return list(urls)
+    selection = SETTINGS.image_selection
+    if selection == 'random':
+        return random.sample(urls, count)
+    if selection == 'spaced':
+        step = len(urls) / float(count)
+        return [urls[int(i * step)] for i in range(count)]
+    return random.Random(int(Hash.MD5(seed)[:8], 16)).sample(urls, count)
+
+def FetchImages(urls, validators):
+    # Downloads urls in parallel and returns url -> content, leaving out failures, 304s, unchanged
+    # bodies and anything still running at IMAGE_DEADLINE. validators is only updated until this returns.
+    pending = []
+    for url in reversed(urls):
+        if url not in pending:
+            pending.append(url)
+    results = {}
+    if not pending:
+        return results
+
+    lock = Thread.Lock()
+    finished = Thread.Event()
+    deadline = time.time() + IMAGE_DEADLINE
+    state = {'workers': min(IMAGE_WORKERS, len(pending)), 'returned': False}
+
+    def worker():
+        while True:
+            with lock:
+                if not pending or time.time() >= deadline or state['returned']:
+                    break
+                url = pending.pop()
+                known = validators.get(url)
+            headers = {}
+            if known:
+                if known.get('etag'):
+                    headers['If-None-Match'] = known['etag']
+                if known.get('modified'):
+                    headers['If-Modified-Since'] = known['modified']
+            try:
+                response = FetchURL(url, headers=headers, deadline=deadline, slot=HostSemaphore(url))
+                content = response.content
+                entry = {
+                    'etag': response.headers.get('ETag'),
+                    'modified': response.headers.get('Last-Modified'),
+                    'hash': Hash.MD5(content),
+                    'checked': time.time(),
+                }
+                with lock:
+                    if state['returned']:
+                        LogDebug('Image arrived after the deadline: {0}', url)
+                    elif known and known.get('hash') == entry['hash']:
+                        LogDebug('Image unchanged: {0}', url)
+                        validators[url] = entry
+                    else:
+                        results[url] = content
+                        validators[url] = entry
+            except urllib2.HTTPError as e:
+                if e.code == 304:
+                    with lock:
+                        if not state['returned']:
+                            validators[url] = dict(known, checked=time.time())
+                    LogDebug('Image not modified: {0}', url)
+                else:
+                    LogDebug('Failed to download image {0}: HTTP {1}', url, e.code)
+            except Exception as e:
+                LogDebug('Failed to download image {0}: {1}', url, e)
+        with lock:
+            state['workers'] -= 1
+            if state['workers'] == 0:
+                finished.set()
+
+    with METRICS.timer('images'):
+        for i in range(state['workers']):
+            Thread.Create(worker)
+        if not finished.wait(max(deadline - time.time(), 0)):
+            LogDebug('Image deadline of {0}s reached, continuing without late images.', IMAGE_DEADLINE)
+            METRICS.count('images.deadline')
+    with lock:
+        state['returned'] = True  # Late downloads no longer touch validators or results
+        METRICS.count('images.downloaded', len(results))
+        return dict(results)
+
+def BoundedLevenshtein(first, second, bound):
+    # Levenshtein distance when it is at most bound, otherwise bound + 1; only the diagonal band is
+    # computed and the scan stops once a whole row exceeds bound
+    if first == second:
+        return 0
+    over = bound + 1
+    if abs(len(first) - len(second)) > bound:
+        return over
+    if len(first) > len(second):
+        first, second = second, first
+    length = len(second)
+    previous = [j if j <= bound else over for j in range(length + 1)]
+    for i in range(1, len(first) + 1):
+        current = [over] * (length + 1)
+        if i <= bound:
+            current[0] = i
+        row_min = current[0]
+        char = first[i - 1]
+        for j in range(max(1, i - bound), min(length, i + bound) + 1):
+            value = min(previous[j - 1] + (char != second[j - 1]), current[j - 1] + 1, previous[j] + 1, over)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > bound:
+            return over
+        previous = current
+    return previous[length]
+
+def RowYear(production_year, release_year, use_production_date):
+    # Returns the year a search row is compared by and where it came from, see score_candidates
+    if use_production_date and production_year is not None and release_year is not None:
+        if production_year < release_year:
+            return production_year, 'production'
+        return release_year, 'release'
+    return (release_year if release_year is not None else production_year), 'default'
 
 def Start():
     HTTP.CacheTime = CACHE_1MINUTE
     HTTP.Headers['User-agent'] = 'Mozilla/4.0 (compatible; MSIE 8.0; Windows NT 6.2; Trident/4.0; SLCC2; .NET CLR 2.0.50727; .NET CLR 3.5.30729; .NET CLR 3.0.30729; Media Center PC 6.0)'
     LogDebug('HTTP headers set and cache time configured.')
+    ApplySettings(LoadSettings())
+    Thread.CreateTimer((SETTINGS.metrics_interval or METRICS_IDLE_CHECK) * 60, ReportMetrics)
 
 def ValidatePrefs():
+    # Changed preferences take effect right away, without restarting the agent
+    try:
+        ApplySettings(LoadSettings())
+    except Exception as e:
+        Log('Invalid preferences, keeping the previous settings: {0}'.format(e))
+        return
     LogDebug('Preferences validated.')
 
+def ApplySettings(settings):
+    # Makes settings the current SETTINGS in one assignment and applies them to the long-lived objects
+    global SETTINGS
+    SETTINGS = settings
+    for cache, ttl in ((DETAIL_CACHE, settings.cache_days * 86400),
+                       (PERFORMER_CACHE, settings.cache_days * 86400),
+                       (SEARCH_CACHE, settings.search_cache_hours * 3600),
+                       (FINGERPRINTS, FINGERPRINT_DAYS * 86400 if settings.skip_unchanged else 0),
+                       (NO_GALLERY, NO_GALLERY_DAYS * 86400),
+                       (IMAGE_VALIDATORS, IMAGE_VALIDATOR_DAYS * 86400)):
+        cache.ttl = ttl
+        cache.max_items = settings.cache_size
+    with REQUEST_BUCKETS_LOCK:
+        REQUEST_BUCKETS.clear()  # Rebuilt at the current request rate on next use
+    LogDebug('Agent debug logging is enabled!')
+    LogDebug('Search Type: {0}, Good Score Threshold: {1}', '+'.join(search_type for search_type, url in settings.search_urls), settings.good_score)
+    LogDebug('Request rate: {0} per second per host', settings.request_rate or 'unlimited')
+    LogDebug('Detail cache: {0} days, {1} entries', settings.cache_days, settings.cache_size)
+    LogDebug('Image selection: {0}, art cap: {1}', settings.image_selection, settings.max_art)
+
 class ADEAgent(Agent.Movies):
     name = 'Adult DVD Empire'
     languages = [Locale.Language.English]
@@ -60,358 +883,776 @@ class ADEAgent(Agent.Movies):
     fallback_agent = ['com.plexapp.agents.themoviedb'] #Personal choice can be taken out
     accepts_from = ['com.plexapp.agents.localmedia']
 
+    @Timed('search')
     def search(self, results, media, lang):
+        settings = SETTINGS
         # Initial Logging to understand what's received
-        LogDebug('Received search query (media.name): {0}'.format(media.name))
-        LogDebug('Received search query (media.title): {0}'.format(media.title))
-        LogDebug('Received filename: {0}'.format(media.filename))
+        LogDebug('Received search query (media.name): {0}', media.name)
+        LogDebug('Received search query (media.title): {0}', media.title)
+        LogDebug('Received filename: {0}', media.filename)
 
         # Decoding the filename to work with it
         decoded_filename = None
         if media.filename:
             decoded_filename = urllib2.unquote(media.filename)
-            LogDebug('Decoded filename: {0}'.format(decoded_filename))
+            LogDebug('Decoded filename: {0}', decoded_filename)
         else:
-            LogDebug('No filename provided for media: {0}'.format(media.name)) # Log a message indicating that no filename was provided
+            LogDebug('No filename provided for media: {0}', media.name) # Log a message indicating that no filename was provided
 
-        # Consolidated Regex for special tags and title/year extraction
-        special_tag_pattern = r'{(tmdb-|imdb-|ade-(\d+))}'
-        title_year_pattern = r'[^\\]*\\([^\\]+) \((\d{4})\)(?: - ?(?:cd|disc|disk|dvd|part|pt)\d+)?(?: \{[^}]*\})?\.([^.]+)$'
         title, year, special_id = None, None, None  # Initialize 'title' and 'year' here
 
         # Check if this might be a manual search by comparing media.name and media.title
-        if media.name and media.name != media.title:
+        manual_search = bool(media.name and media.name != media.title)
+        if manual_search:
             # Manual entry likely, use media.name
             search_query = media.name
-            LogDebug('Manual search detected, using media.name: {0}' .format(search_query))
+            LogDebug('Manual search detected, using media.name: {0}', search_query)
         else:
             # Automatic or no specific search handling
             if decoded_filename is not None:  # Check if decoded_filename is not None before proceeding
-                special_tags = re.findall(special_tag_pattern, decoded_filename)
+                special_tags = SPECIAL_TAG.findall(decoded_filename)
                 LogDebug('Special Tag found')
             
                 for tag in special_tags:
-                    LogDebug('Found special tag: {0}'.format(tag[0]))  # Using index 0 if tag is a tuple
+                    LogDebug('Found special tag: {0}', tag[0])  # Using index 0 if tag is a tuple
                     if 'tmdb' in tag[0] or 'imdb' in tag[0]:
                         LogDebug('TMDB or IMDB tag found, skipping search.')
                         return
-                    elif 'ade-' in tag[0]:
-                        # Extract just the numeric part after 'ade-'
-                        ade_id_match = re.search(r'ade-(\d+)', tag[0])
-                        if ade_id_match:
-                            special_id = ade_id_match.group(1)
-                            LogDebug('Special ADE ID found: {0}'.format(special_id))
+                    elif tag[1]:
+                        # The pattern captures just the numeric part after 'ade-'
+                        special_id = tag[1]
+                        LogDebug('Special ADE ID found: {0}', special_id)
             else:
                 search_query = media.name
-                LogDebug('No decoded filename available for media: {0}'.format(media.name))
+                LogDebug('No decoded filename available for media: {0}', media.name)
 
         # Attempt to extract title and year from filename
-        match = re.search(title_year_pattern, decoded_filename)
+        match = TITLE_YEAR.search(decoded_filename)
         if match:
             title, year, ext = match.groups()
             title = title.strip()  # Clean up any leading/trailing whitespace
-            LogDebug('Extracted title: {0}, year: {1}, extension: {2}'.format(title, year, ext))          
+            LogDebug('Extracted title: {0}, year: {1}, extension: {2}', title, year, ext)          
         else:
             # Fallback to media.name and media.year if regex fails
             title = media.name if media.name else media.title
             year = media.year if media.year else None
-            LogDebug('Using fallback title: {0}, year: {1}'.format(title, year))
+            LogDebug('Using fallback title: {0}, year: {1}', title, year)
 
 
         # Use the determined 'title' for further processing
-        LogDebug('Received search query: {0}'.format(title))
+        LogDebug('Received search query: {0}', title)
 
         # Adjust title if it starts with 'The'
         if title.lower().startswith('the '):
             title = title[4:] + ', The'
 
-        encoded_title = String.URLEncode(String.StripDiacritics(title.replace('-', '')))
-        LogDebug('Formatted search query: {}'.format(encoded_title))
-        search_url = ADE_SEARCH_MOVIES % encoded_title
-        LogDebug('Constructed search URL: {}'.format(search_url))
+        # A tagged file resolves straight from its detail page, which also primes the cache for update
+        if special_id and self.search_by_id(results, special_id, year, lang):
+            return
 
-        movie_dict = {}
+        encoded_title = String.URLEncode(String.StripDiacritics(title.replace('-', '')))
+        LogDebug('Formatted search query: {}', encoded_title)
+        search_urls = [(search_type, url % encoded_title) for search_type, url in settings.search_urls]
+        for search_type, search_url in search_urls:
+            LogDebug('Constructed search URL: {}', search_url)
 
         try:
-            search_page = HTML.ElementFromURL(search_url)
-            LogDebug('Search page successfully retrieved.')
-            movies = search_page.xpath('//div[contains(@class,"row list-view-item")]')
-            LogDebug('Found {0} movies on the search page.'.format(len(movies)))
-            if not movies:
-                LogDebug('No movies found on the search page.')
-                return
-
-            for movie in movies:
-                title_element = movie.xpath('.//a[contains(@label,"Title")]')
-                if title_element:
-                    movie_title = title_element[0].text_content().strip()
-                else: 
-                    LogDebug('Movie title element not found')
-                    continue  # Skip to the next movie if the title element is missing
-
-                LogDebug('Processing movie: {0}'.format(movie_title))
-
-                # Adjust title format if it ends with ', The'
-                if movie_title.endswith(', The'):
-                    movie_title = 'The ' + movie_title[:-5]
-                    LogDebug('Adjusted movie title: {0}'.format(movie_title))
-                
-                href_element = title_element[0].get('href')
-                if href_element:
-                    movie_id = href_element.split('/', 2)[1]
-                    LogDebug('Movie ID: {0}'.format(movie_id))
-                else:
-                    LogDebug('No href found for movie: {0}'.format(movie_title))
-                    continue
-
-                dvd_elements = movie.xpath('.//a[@title="DVD" or @title="dvd"]')
-                movie_format = 'DVD' if dvd_elements else 'VOD'
-                LogDebug('Movie format: {0}'.format(movie_format))
-                
-                # Extract production year
-                production_year_element = movie.xpath('.//a[contains(@aria-label, "View")]/following-sibling::text()[1]')
-                production_year = None
-                if production_year_element:
-                    production_year_text = production_year_element[0].strip()
-                    production_year_match = re.search(r'\d{4}', production_year_text)
-                    if production_year_match:
-                        production_year = int(production_year_match.group())
-                        LogDebug('Production year found: {0}'.format(production_year))
-                    else:
-                        LogDebug('No production year match found for text: {0}'.format(production_year_text))
-                else:
-                    LogDebug('Production year element not found for movie: {0}'.format(movie_title))
-
-                # Extract release year
-                release_year_element = movie.xpath('.//small[contains(text(),"released")]/following-sibling::text()')
-                release_year = None
-                if release_year_element:
-                    release_year_text = release_year_element[0].strip()
-                    release_year_match = re.search(r'\d{4}', release_year_text)
-                    if release_year_match:
-                        release_year = int(release_year_match.group())
-                        LogDebug('Release year found: {0}'.format(release_year))
-                    else:
-                        LogDebug('No release year match found for text: {0}'.format(release_year_text))
-                else:
-                    LogDebug('Release year element not found for movie: {0}'.format(movie_title))
-
-                # Check preference to use production year if it's less than release year
-                if useproductiondate and production_year is not None and release_year is not None:
-                    if production_year < release_year:
-                        cur_year = production_year
-                        LogDebug('Using production year: {0}'.format(cur_year))
-                    else:
-                        cur_year = release_year
-                        LogDebug('Using release year: {0}'.format(cur_year))
-                else:
-                    cur_year = release_year if release_year is not None else production_year
-                    LogDebug('Using default year: {0}'.format(cur_year))               
-
-                score = INITIAL_SCORE - Util.LevenshteinDistance(title.lower(), movie_title.lower())
-                LogDebug('Raw Score for movie: {0}'.format (score))
-                # Check if years match, and apply a penalty if they do not
-
-                if year and cur_year:
-                   year = int(year)
-                   cur_year = int(cur_year)
-                LogDebug('Comparing years - Extracted Year: {0}, Movie Year: {1}'.format(year, cur_year))
-
-                if year and cur_year:
-                    if year != cur_year:
-                        year_penalty = 10
-                        score = score - year_penalty
-                        LogDebug('Year penalty applied for movie: {0}; Penalty: -{1}, New Score: {2}'.format(movie_title, year_penalty, score))
-                    else:
-                        LogDebug('Years match, no penalty applied. Year: {0}, Movie Year: {1}'.format(year, cur_year))
-                else:
-                    LogDebug('One of the year values is None. Year: {0}, Movie Year: {1}'.format(year, cur_year))
-                 
-                if special_id and movie_id == special_id:
-                    movie_dict.clear()  # Clearing all previous entries if special ID matches
-                    movie_dict[(movie_title, cur_year)] = [(movie_id, movie_format, 100)]
-                    break  # Stop further processing as we found the match
-                else:
-                    if (movie_title, cur_year) not in movie_dict:
-                        movie_dict[(movie_title, cur_year)] = []
-                    movie_dict[(movie_title, cur_year)].append((movie_id, movie_format, score))
-
-                LogDebug('Score for movie: {0} is {1}'.format(movie_title, score))
-
-            # Process scoring adjustments for DVD and VOD entries
-            for key, entries in movie_dict.items():
-                dvd_present = False
-                for entry in entries:
-                    if entry[1] == 'DVD':
-                        dvd_present = True
-                        break
-                
-                if dvd_present:
-                    for i, (id, format, score) in enumerate(entries):
-                        if format == 'VOD':
-                            entries[i] = (id, format, score // 2)
-                            LogDebug('Adjusted VOD score for {0}: {1}'.format(key[0], score // 2))
-
-
-            # Append results to Plex based on GOOD_SCORE threshold
-            good_results_exist = False
-
-            # First pass to check if any good results exist
-            for key, movie_info in movie_dict.items():
-                for id, format, score in movie_info:
-                    if score >= GOOD_SCORE:       
-                        good_results_exist = True
-                        break
-                if good_results_exist:
-                     break            
-
-            # Second pass to append results based on the existence of good results
-            for key, movie_info in movie_dict.items():
-                for id, format, score in movie_info:
-                    title_with_year = "{} ({})".format(key[0], key[1]) if key[1] else key[0]  # Append year if available
-                    # Check if any good results exist, append only those; else append all
+            # Titles seen before are answered from the local title index when one scores the good score
+            if settings.local_match and not manual_search:
+                local_candidates = TITLE_INDEX.lookup(title)
+                if local_candidates:
+                    matches, good_results_exist = self.score_candidates(local_candidates, title, year, special_id, lang)
+                    METRICS.count('titleindex.hit' if good_results_exist else 'titleindex.miss')
                     if good_results_exist:
-                        if score >= GOOD_SCORE:
-                            results.Append(MetadataSearchResult(id=id, name=title_with_year, score=score, lang=lang))
-                    else:
-                        results.Append(MetadataSearchResult(id=id, name=title_with_year, score=score, lang=lang))
+                        for match in matches:
+                            results.Append(match)
+                        results.Sort('score', descending=True)
+                        LogDebug('Matched from the local title index, {0} results.', len(matches))
+                        self.prefetch(matches, settings)
+                        return
+                    LogDebug('No good match in the local title index, searching ADE.')
+
+            # An automatic search of one listing stops reading rows at the one that scores a perfect
+            # match. Across listings, the DVD rows it skips could halve a VOD row in another listing.
+            target = None
+            if not manual_search and len(search_urls) == 1:
+                target = (title.lower(), int(year) if year and str(year).isdigit() else None, special_id)
+
+            # Identical lookups (multi-part files, re-scans) share one request and its parsed rows.
+            # Later result pages are only read while nothing scores the good score.
+            query = ' '.join(title.replace('-', '').lower().split())
+            candidates = []
+            page = 1
+            while True:
+                # search_urls narrows to the endpoints that link another page
+                rows, search_urls = self.search_page(search_urls, query, page, target, settings)
+                # Listings shift while paging, so a row already seen on an earlier page is skipped
+                seen = set(row[1] for row in candidates)
+                candidates.extend(row for row in rows if row[1] not in seen)
+                LogDebug('Found {0} movies on search page {1}.', len(rows), page)
+                if not candidates:
+                    LogDebug('No movies found on the search page.')
+                    return
+                matches, good_results_exist = self.score_candidates(candidates, title, year, special_id, lang)
+                if good_results_exist or not search_urls or page >= SEARCH_MAX_PAGES:
+                    break
+                page += 1
+                LogDebug('No good match yet, reading search page {0}.', page)
+
+            # Remember every row seen so later files with these titles can be matched locally
+            TITLE_INDEX.add_candidates(candidates)
+            for match in matches:
+                results.Append(match)
 
-            
             results.Sort('score', descending=True)
             LogDebug('Results processed and appended based on score threshold.')
+            if good_results_exist:
+                self.prefetch(matches, settings)
 
         except urllib2.HTTPError as e:
-            LogDebug('HTTP Error: {0} - {1}'.format(e.code, search_url))
+            LogDebug('HTTP Error: {0} - searching {1}', e.code, title)
         except urllib2.URLError as e:
-            LogDebug('URL Error: {0} - {1}'.format(e.reason, search_url))
+            LogDebug('URL Error: {0} - searching {1}', e.reason, title)
         except Exception as e:
-            LogDebug('Failed to fetch or parse search results: {0}'.format(str(e)))
+            LogDebug('Failed to fetch or parse search results: {0}', e)
+
+    def prefetch(self, matches, settings):
+        # Queues the detail pages of the best scoring matches, the ones Plex is about to update
+        if not settings.prefetch_count or not settings.cache_days:
+            return
+        best = matches[:settings.prefetch_count]  # score_candidates returns the best first
+        ade_ids = [match.id for match in best if match.score >= settings.good_score]
+        if ade_ids:
+            LogDebug('Prefetching details for: {0}', ade_ids)
+            PREFETCHER.add(ade_ids, self.prime_details)
+
+    @Timed('search.score')
+    def score_candidates(self, candidates, title, year, special_id, lang):
+        # Returns (matches, good_results_exist): the rows at the good score, or every row when none is,
+        # best first. Live and TITLE_INDEX rows are scored alike, in a single pass.
+        settings = SETTINGS
+        good_score, score_bound, debug = settings.good_score, settings.score_bound, settings.debug
+        query = title.lower()  # Normalized once, compared against every candidate
+        # Each (title, year) keeps its rows and their scores in two parallel lists, so a row costs
+        # two list slots rather than a record. A score is None while the title is too far off to
+        # reach the good score.
+        groups = {}  # (title, year) -> (rows, scores)
+        ordered = []  # The keys, in the order they first appear in
+        dvd_keys = set()
+        good_count = 0
+        settled = False
+        for row in candidates:
+            movie_title, movie_id, movie_format, production_year, release_year = row
+            # Check preference to use production year if it's less than release year
+            cur_year, year_source = RowYear(production_year, release_year, settings.use_production_date)
+
+            # Titles more than score_bound edits away can't reach good_score, so the distance
+            # scan gives up on them early; they are scored exactly later only if nothing is good
+            distance = BoundedLevenshtein(query, movie_title.lower(), score_bound)
+            score = raw_score = INITIAL_SCORE - distance if distance <= score_bound else None
+            # Check if years match, and apply a penalty if they do not
+
+            if year and cur_year:
+               year = int(year)
+               cur_year = int(cur_year)
+
+            year_penalty = 0
+            if year and cur_year and year != cur_year:
+                year_penalty = 10
+                if score is not None:
+                    score = score - year_penalty
+
+            # Per-row messages are only built when debug logging is on
+            if debug:
+                LogDebug('Processing movie: {0}', movie_title)
+                LogDebug('Using {0} year: {1}', year_source, cur_year)
+                LogDebug('Raw Score for movie: {0}', raw_score if raw_score is not None else 'below good score')
+                LogDebug('Comparing years - Extracted Year: {0}, Movie Year: {1}', year, cur_year)
+                if not (year and cur_year):
+                    LogDebug('One of the year values is None. Year: {0}, Movie Year: {1}', year, cur_year)
+                elif year_penalty:
+                    LogDebug('Year penalty applied for movie: {0}; Penalty: -{1}, New Score: {2}', movie_title, year_penalty, score)
+                else:
+                    LogDebug('Years match, no penalty applied. Year: {0}, Movie Year: {1}', year, cur_year)
+
+            if special_id and movie_id == special_id:
+                # Dropping all previous entries if special ID matches, and stop further processing
+                key = (movie_title, cur_year)
+                groups = {key: ([row], [100])}
+                ordered = [key]
+                good_count = 1 if 100 >= good_score else 0
+                break
+
+            if debug:
+                LogDebug('Score for movie: {0} is {1}', movie_title, score)
+
+            if settled and (score is None or score < good_score):
+                # Only good rows are shown now, and this one can't halve one of them: a VOD or DVD
+                # twin has the same title and year, so the same score
+                continue
+
+            key = (movie_title, cur_year)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = ([], [])
+                ordered.append(key)
+            rows, scores = group
+
+            # Process scoring adjustments for DVD and VOD entries: a VOD row of a title that also has
+            # a DVD row is halved, whichever of the two comes first. Rows of any other format, e.g.
+            # the title index's, neither halve nor get halved.
+            dvd = movie_format == 'DVD'
+            if movie_format == 'VOD' and key in dvd_keys and score is not None:
+                score = score // 2
+                if debug:
+                    LogDebug('Adjusted VOD score for {0}: {1}', movie_title, score)
+            elif dvd and key not in dvd_keys:
+                dvd_keys.add(key)
+                for index, other in enumerate(rows):
+                    if other[2] == 'VOD' and scores[index] is not None:
+                        if scores[index] >= good_score:
+                            good_count -= 1
+                        scores[index] = scores[index] // 2
+                        if debug:
+                            LogDebug('Adjusted VOD score for {0}: {1}', movie_title, scores[index])
+            rows.append(row)
+            scores.append(score)
+            if score is not None and score >= good_score:
+                good_count += 1
+                # A DVD row keeps its score, so from here on only good rows are shown
+                settled = settled or dvd
+
+        # Results are collected per score in title order, then emitted best score first
+        good_results_exist = good_count > 0
+        by_score = {}
+        for key in ordered:
+            movie_title, cur_year = key
+            title_with_year = "{} ({})".format(movie_title, cur_year) if cur_year else movie_title  # Append year if available
+            rows, scores = groups[key]
+            for index, row in enumerate(rows):
+                score = scores[index]
+                if good_results_exist:
+                    # Append only the good results
+                    if score is None or score < good_score:
+                        continue
+                elif score is None:
+                    # Without a good result every row is shown, so score the ones skipped above exactly
+                    year_penalty = 10 if year and cur_year and year != cur_year else 0
+                    score = INITIAL_SCORE - Util.LevenshteinDistance(query, movie_title.lower()) - year_penalty
+                    if row[2] == 'VOD' and key in dvd_keys:
+                        score = score // 2
+                results = by_score.get(score)
+                if results is None:
+                    results = by_score[score] = []
+                results.append(MetadataSearchResult(id=row[1], name=title_with_year, score=score, lang=lang))
+
+        matches = []
+        for score in sorted(by_score, reverse=True):
+            matches.extend(by_score[score])
+        return matches, good_results_exist
+
+    def search_by_id(self, results, special_id, year, lang):
+        # Appends a single score-100 result for an {ade-NNNN} tag. Returns False when the id can't
+        # be resolved so the caller falls back to the title search.
+        try:
+            details = self.prime_details(special_id)
+            if not details.get('title'):
+                # A removed title's page still loads, it just has no movie on it
+                LogDebug('No movie found for special ADE ID {0}', special_id)
+                return False
+            movie_title = details['title']
+            if movie_title.endswith(', The'):
+                movie_title = 'The ' + movie_title[:-5]
+            cur_year = year
+            if details['production_year'] and details['production_year'].isdigit():
+                cur_year = details['production_year']
+            title_with_year = "{} ({})".format(movie_title, cur_year) if cur_year else movie_title
+            results.Append(MetadataSearchResult(id=special_id, name=title_with_year, score=100, lang=lang))
+            LogDebug('Resolved special ADE ID {0} directly: {1}', special_id, title_with_year)
+            return True
+        except urllib2.HTTPError as e:
+            LogDebug('HTTP Error: {0} - resolving special ADE ID {1}', e.code, special_id)
+        except urllib2.URLError as e:
+            LogDebug('URL Error: {0} - resolving special ADE ID {1}', e.reason, special_id)
+        except Exception as e:
+            LogDebug('Failed to resolve special ADE ID {0}: {1}', special_id, e)
+        return False
+
+    def prime_details(self, ade_id):
+        # Returns the parsed details for an ADE id, downloading and caching them on a miss; concurrent
+        # calls for one id (a prefetch and bulk import, say) share a single download
+        return DETAIL_FLIGHTS.do(ade_id, self.load_details, ade_id)
+
+    def load_details(self, ade_id):
+        details = DETAIL_CACHE.get(ade_id)
+        if details is None:
+            details = self.parse_details(FetchPage(ADE_MOVIE_INFO % ade_id))
+            if details.get('title'):
+                DETAIL_CACHE.set(ade_id, details)
+                LogDebug('Movie info page retrieved and cached for ID: {0}', ade_id)
+        else:
+            LogDebug('Movie details served from cache for ID: {0}', ade_id)
+        return details
+
+    def search_page(self, search_urls, query, page, target, settings):
+        # Returns (rows, following) for one page of results over every endpoint, requested in parallel
+        # and merged without repeating an id; following holds the endpoints with a next page
+        entries = [None] * len(search_urls)
+        errors = []
+        lock = Thread.Lock()
+        finished = Thread.Event()
+        state = {'pending': len(search_urls)}
+
+        def fetch(index):
+            search_type, search_url = search_urls[index]
+            key = '{0}|{1}'.format(search_type, query)
+            cache_key = Hash.MD5(key if page == 1 else '{0}|{1}'.format(key, page))
+            page_url = search_url if page == 1 else '{0}&page={1}'.format(search_url, page)
+            try:
+                row_format = SEARCH_ROW_FORMATS.get(search_type)
+                entry = SEARCH_FLIGHTS.do(cache_key, self.search_candidates, page_url, cache_key, page, target, row_format)
+                if not entry['complete'] and not self.has_target(entry['rows'], target, settings):
+                    # Shared with a search that stopped early at a different row
+                    entry = self.search_candidates(page_url, cache_key, page, target, row_format, refresh=True)
+                entries[index] = entry
+            except Exception as e:
+                if page == 1 or not (isinstance(e, urllib2.HTTPError) and e.code == 404):
+                    with lock:
+                        errors.append(e)
+            finally:
+                with lock:
+                    state['pending'] -= 1
+                    if state['pending'] == 0:
+                        finished.set()
+
+        # The first endpoint is requested on this thread, the others alongside it
+        for index in range(1, len(search_urls)):
+            Thread.Create(lambda index=index: fetch(index))
+        fetch(0)
+        finished.wait()
+
+        answered = [entry for entry in entries if entry is not None]
+        if errors and page == 1 and not answered:
+            raise errors[0]
+        for error in errors:
+            LogDebug('Leaving out a failed search on page {0}: {1}', page, error)
+        following = [search_url for search_url, entry in zip(search_urls, entries) if entry is not None and entry['next']]
+        if len(answered) == 1:
+            return answered[0]['rows'], following
+        rows = []
+        seen = set()
+        for entry in answered:
+            for row in entry['rows']:
+                if row[1] not in seen:
+                    seen.add(row[1])
+                    rows.append(row)
+        return rows, following
+
+    def search_candidates(self, search_url, cache_key, page, target, row_format=None, refresh=False):
+        # Returns one search page's entry of rows, completeness and next-page link, cached in SEARCH_CACHE
+        entry = None if refresh else SEARCH_CACHE.get(cache_key)
+        if entry is not None:
+            if isinstance(entry, list):  # Cached before pages and early stops were tracked
+                entry = {'rows': entry, 'complete': True, 'next': False}
+            LogDebug('Search results served from cache.')
+            return entry
+        content = FetchURL(search_url).content
+        LogDebug('Search page successfully retrieved.')
+        entry = self.parse_search_page(content, page, target, row_format)
+        SEARCH_CACHE.set(cache_key, entry)
+        return entry
+
+    def has_target(self, rows, target, settings):
+        # Whether an automatic search can stop at rows: one of them is the special ADE id, or a DVD
+        # with the exact title in the searched year, which keeps its perfect score, and no VOD row
+        # that could score the good score is still waiting for a DVD twin further down to halve it
+        if target is None:
+            return False
+        for row in rows:
+            if self.is_target(row, target, settings):
+                return bool(target[2]) or not self.halving_pending(rows, target[0], settings)
+        return False
+
+    def halving_pending(self, rows, query, settings):
+        use_production_date, score_bound = settings.use_production_date, settings.score_bound
+        dvd_keys = set((row[0], RowYear(row[3], row[4], use_production_date)[0]) for row in rows if row[2] == 'DVD')
+        for movie_title, movie_id, movie_format, production_year, release_year in rows:
+            if (movie_format == 'VOD' and (movie_title, RowYear(production_year, release_year, use_production_date)[0]) not in dvd_keys
+                    and BoundedLevenshtein(query, movie_title.lower(), score_bound) <= score_bound):
+                return True
+        return False
+
+    def is_target(self, row, target, settings):
+        query, year, special_id = target
+        movie_title, movie_id, movie_format, production_year, release_year = row
+        if special_id:
+            return movie_id == special_id
+        if movie_format != 'DVD' or movie_title.lower() != query:
+            return False
+        return year is None or RowYear(production_year, release_year, settings.use_production_date)[0] == year
+
+    @Timed('parse.search')
+    def parse_search_page(self, content, page, target, row_format=None):
+        # Extracts (title, id, format, production year, release year) per row, parsing each row's
+        # fragment on its own and stopping after the target row. row_format is the format of every
+        # row of a single format's listing; otherwise a row is a DVD when it links one.
+        settings = SETTINGS
+        debug = settings.debug
+        # The fragments lose the page's charset declaration, so the page is decoded once up front
+        # instead of leaving lxml to guess each fragment's encoding
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        starts = [match.start() for match in SEARCH_ROW_START.finditer(content)]
+        pages = set(int(number) for number in SEARCH_PAGE_LINK.findall(content))
+        entry = {'rows': [], 'complete': True, 'next': page + 1 in pages}
+        candidates = entry['rows']
+        for index, start in enumerate(starts):
+            fragment = content[start:starts[index + 1]] if index + 1 < len(starts) else content[start:]
+            movies = SEARCH_ROWS(HTML.ElementFromString(fragment))
+            if not movies:
+                continue
+            movie = movies[0]
+            title_element = ROW_TITLE(movie)
+            if title_element:
+                movie_title = title_element[0].text_content().strip()
+            else: 
+                LogDebug('Movie title element not found')
+                continue  # Skip to the next movie if the title element is missing
+
+            # Adjust title format if it ends with ', The'
+            listed_title = movie_title
+            if movie_title.endswith(', The'):
+                movie_title = 'The ' + movie_title[:-5]
+
+            href_element = title_element[0].get('href')
+            if href_element:
+                movie_id = href_element.split('/', 2)[1]
+            else:
+                LogDebug('No href found for movie: {0}', movie_title)
+                continue
+
+            movie_format = row_format or ('DVD' if ROW_DVD(movie) else 'VOD')
+
+            # Extract production year
+            production_year_element = ROW_PRODUCTION_YEAR(movie)
+            production_year_text = production_year_element[0].strip() if production_year_element else None
+            production_year_match = YEAR.search(production_year_text) if production_year_text else None
+            production_year = int(production_year_match.group()) if production_year_match else None
+
+            # Extract release year
+            release_year_element = ROW_RELEASE_YEAR(movie)
+            release_year_text = release_year_element[0].strip() if release_year_element else None
+            release_year_match = YEAR.search(release_year_text) if release_year_text else None
+            release_year = int(release_year_match.group()) if release_year_match else None
+
+            if debug:
+                LogDebug('Parsing search row: {0}', listed_title)
+                if movie_title != listed_title:
+                    LogDebug('Adjusted movie title: {0}', movie_title)
+                LogDebug('Movie ID: {0}', movie_id)
+                LogDebug('Movie format: {0}', movie_format)
+                if production_year is not None:
+                    LogDebug('Production year found: {0}', production_year)
+                elif production_year_element:
+                    LogDebug('No production year match found for text: {0}', production_year_text)
+                else:
+                    LogDebug('Production year element not found for movie: {0}', movie_title)
+                if release_year is not None:
+                    LogDebug('Release year found: {0}', release_year)
+                elif release_year_element:
+                    LogDebug('No release year match found for text: {0}', release_year_text)
+                else:
+                    LogDebug('Release year element not found for movie: {0}', movie_title)
+
+            candidates.append((movie_title, movie_id, movie_format, production_year, release_year))
+            # Only the special id's row or a DVD row can end the page early
+            if target is not None and (movie_format == 'DVD' or movie_id == target[2]) and self.has_target(candidates, target, settings):
+                LogDebug('Exact match found, not parsing the rest of the search page.')
+                entry['complete'] = index + 1 == len(starts)
+                break
 
+        return entry
+
+    @Timed('update')
     def update(self, metadata, media, lang):
-        LogDebug('Starting metadata update for ID: {0}'.format(metadata.id))
+        settings = SETTINGS
+        LogDebug('Starting metadata update for ID: {0}', metadata.id)
         info_url = ADE_MOVIE_INFO % metadata.id
-        LogDebug('Constructed movie info URL: {0}'.format(info_url))
+        LogDebug('Constructed movie info URL: {0}', info_url)
 
         
         try:
-            info_page = HTML.ElementFromURL(info_url)
-            LogDebug('Movie info page retrieved.')
-
             # Update movie title from the title from the media information
-            import re
-            title_without_year = re.sub(r"\s*\(\d{4}\)\s*$", "", media.title)  # Regex to remove year from the end
+            title_without_year = TRAILING_YEAR.sub("", media.title)  # Regex to remove year from the end
+            context = UpdateContext(title_without_year)
+
+            # A title whose page and settings are the same as on its last update, and that still
+            # shows what that update wrote, is left alone. Random image selection never matches.
+            last = FINGERPRINTS.get(metadata.id)
+            if last and (last['context'] != context or metadata.title != title_without_year or settings.image_selection == 'random'):
+                last = None
+
+            PREFETCHER.claim(metadata.id, PREFETCH_WAIT)
+            details = DETAIL_CACHE.get(metadata.id)
+            cache_dirty = details is None
+            validators = {}
+            if details is not None:
+                LogDebug('Movie details served from cache.')
+            else:
+                headers = {}
+                if last and last.get('etag'):
+                    headers['If-None-Match'] = last['etag']
+                if last and last.get('modified'):
+                    headers['If-Modified-Since'] = last['modified']
+                try:
+                    response = FetchURL(info_url, headers=headers)
+                except urllib2.HTTPError as e:
+                    if e.code == 304 and headers:
+                        METRICS.count('update.unchanged')
+                        LogDebug('Movie info page not modified, skipping update for ID: {0}', metadata.id)
+                        return
+                    raise
+                validators = {'etag': response.headers.get('ETag'), 'modified': response.headers.get('Last-Modified')}
+                info_page = ParsePage(response.content)
+                LogDebug('Movie info page retrieved.')
+                details = self.parse_details(info_page)
+
+            TITLE_INDEX.add_details(metadata.id, details)
+
+            fingerprint = DetailsFingerprint(details)
+            if last and last['fingerprint'] == fingerprint:
+                METRICS.count('update.unchanged')
+                LogDebug('Movie details unchanged, skipping update for ID: {0}', metadata.id)
+                if cache_dirty:
+                    DETAIL_CACHE.set(metadata.id, details)
+                    last.update(validators)
+                    FINGERPRINTS.set(metadata.id, last)
+                return
+
             metadata.title = title_without_year
-            LogDebug('Updated movie title: {0}'.format(metadata.title))
+            LogDebug('Updated movie title: {0}', metadata.title)
 
             # Tagline
-            self.update_tagline(metadata, info_page)
+            self.update_tagline(metadata, details)
 
             # Summary
-            self.update_summary(metadata, info_page)
+            self.update_summary(metadata, details)
 
             # Rating
-            self.update_rating(metadata, info_page)
+            self.update_rating(metadata, details)
 
             # Content Rating
-            self.update_content_rating(metadata, info_page)
+            self.update_content_rating(metadata, details)
 
             # Studio
-            self.update_studio(metadata, info_page)
+            self.update_studio(metadata, details)
 
             # Originally Available At
-            self.update_originally_available_at(metadata, info_page)
+            self.update_originally_available_at(metadata, details)
 
             # Production Year
-            self.update_year(metadata, info_page)
-
-            # Thumbnail and Poster
-            self.update_posters(metadata, info_page)
+            self.update_year(metadata, details)
 
             # Update cast
-            self.update_cast(metadata, info_page)
+            self.update_cast(metadata, details)
 
             # Update director
-            self.update_director(metadata, info_page)
+            self.update_director(metadata, details)
 
             # Update genres
-            self.update_genres(metadata, info_page)
+            self.update_genres(metadata, details)
+
+            # Thumbnail and Poster
+            poster_urls = [details['poster']] if details['poster'] else []
 
             # Pulling screenshots if enabled
-            if Prefs['pullscreens']:
-                self.retrieve_screenshots(metadata, info_page)
+            art_urls = []
+            if settings.pull_screens:
+                art_urls.extend(self.retrieve_screenshots(details, metadata.id))
 
             # Pulling gallery images if available and enabled
-            if Prefs['pullgallery']:
-                self.retrieve_gallery_images(metadata, info_url)
+            if settings.pull_gallery:
+                if details['gallery'] is None:
+                    cache_dirty = True
+                art_urls.extend(self.retrieve_gallery_images(details, info_url, metadata.id))
+
+            # Cap the art kept on the item; anything attached beyond the selection is evicted below
+            if settings.max_art:
+                art_urls = art_urls[:settings.max_art]
+
+            # Download every selected image at once, then assign them in selection order
+            image_index = {}
+            for url in poster_urls + art_urls:
+                entry = IMAGE_VALIDATORS.get(Hash.MD5(url))
+                if entry:
+                    image_index[url] = entry
+            fetch_urls = self.images_to_fetch(metadata.posters, poster_urls, image_index) + self.images_to_fetch(metadata.art, art_urls, image_index)
+            images = FetchImages(fetch_urls, image_index)
+            for url in fetch_urls:
+                if url in image_index:
+                    IMAGE_VALIDATORS.set(Hash.MD5(url), image_index[url])
+            self.update_posters(metadata, poster_urls, images)
+            self.update_art(metadata, art_urls, images)
+            if settings.max_art:
+                metadata.art.validate_keys(art_urls)
 
             # Update collections
-            if Prefs['studioascollection'] and metadata.studio:
-                self.update_collections(metadata, info_page, metadata.studio)
+            if settings.studio_as_collection and metadata.studio:
+                self.update_collections(metadata, details, metadata.studio)
 
             # Additional metadata fields can be updated here...
-            
+
+            if cache_dirty:
+                DETAIL_CACHE.set(metadata.id, details)
+                LogDebug('Movie details cached for ID: {0}', metadata.id)
+
+            # Only an update that attached every selected image and read the gallery it needed is
+            # recorded; otherwise the next refresh does the full update again to finish the job
+            complete = (all(url in metadata.posters for url in poster_urls) and all(url in metadata.art for url in art_urls)
+                        and not (settings.pull_gallery and details['gallery'] is None))
+            if not complete:
+                LogDebug('Update incomplete, not recording a fingerprint for ID: {0}', metadata.id)
+                FINGERPRINTS.remove(metadata.id)
+                return
+
+            if not validators and last:
+                validators = last  # Served from the detail cache, the page validators still hold
+            FINGERPRINTS.set(metadata.id, {
+                'fingerprint': fingerprint,
+                'context': context,
+                'etag': validators.get('etag'),
+                'modified': validators.get('modified'),
+            })
+
         except urllib2.HTTPError as e:
-            LogDebug('HTTP Error: {0} - {1}'.format(e.code, search_url))
+            LogDebug('HTTP Error: {0} - {1}', e.code, info_url)
         except urllib2.URLError as e:
-            LogDebug('URL Error: {0} - {1}'.format(e.reason, search_url))
+            LogDebug('URL Error: {0} - {1}', e.reason, info_url)
         except Exception as e:
-            LogDebug('Failed to update metadata: {0}'.format(str(e)))
-
-    def update_tagline(self, metadata, info_page):
-        try:
-            tagline_element = info_page.xpath('//h2[contains(@class, "test")]/text()')
-            if tagline_element:
-                tagline = tagline_element[0].strip()
-                metadata.tagline = tagline
-                LogDebug('Tagline Found and Set: {0}'.format(metadata.tagline))
-            else:
-                LogDebug('No tagline element found.')
-        except Exception as e:
-            LogDebug('Exception while parsing tagline: {0}'.format(str(e)))
+            LogDebug('Failed to update metadata: {0}', e)
+
+    def first_text(self, nodes):
+        # Returns the first text node stripped, or None
+        if nodes:
+            return nodes[0].strip()
+        return None
+
+    @Timed('parse.details')
+    def parse_details(self, info_page):
+        # Extracts every field the update methods use in one DETAIL_NODES scan, as a plain dict that can
+        # be kept in DETAIL_CACHE
+        details = {
+            'title': None,
+            'tagline': None,
+            'summary': None,
+            'rating': None,
+            'content_rating': None,
+            'studio': None,
+            'released': None,
+            'production_year': None,
+            'poster': None,
+            'screenshots': [],
+            'cast': [],
+            'directors': [],
+            'genres': [],
+            'series': None,
+            'gallery': [],  # None when the page links a gallery, filled in on first use by retrieve_gallery_images
+            'gallery_size': None,  # Image count shown on the gallery link, if any
+        }
+        # Labelled <li><small>Label</small> value</li> rows, first match wins
+        labels = {'Rating: ': 'content_rating', 'Released:': 'released', 'Production Year:': 'production_year'}
+
+        for node in DETAIL_NODES(info_page):
+            try:
+                tag = node.tag
+                if tag == 'a':
+                    label = node.get('label') or ''
+                    if 'Director - details' in label:
+                        for director_name in TEXT_NODES(node):
+                            if director_name.strip():
+                                details['directors'].append(director_name.strip())
+                    if 'Series' in label and details['series'] is None:
+                        details['series'] = node.text_content().strip().split('"')[1]  # Parsing might vary based on actual HTML structure
+                    if label == 'Category' and GENRE_LIST(node):
+                        for genre in TEXT_NODES(node):
+                            if genre.strip():
+                                details['genres'].append(genre.strip())
+                    if 'scenescreenshots' in (node.get('rel') or ''):
+                        details['screenshots'].append(node.attrib['href'])
+                    if (node.get('href') or '').rstrip('/').endswith('/gallery'):
+                        size = GALLERY_SIZE.search(node.text_content())
+                        if size:
+                            details['gallery_size'] = int(size.group(1))
+                        if details['gallery_size'] != 0:
+                            details['gallery'] = None
+                elif tag == 'li':
+                    for label in LABEL_NODES(node):
+                        if label in labels and details[labels[label]] is None:
+                            details[labels[label]] = self.first_text(LABEL_VALUE_NODES(node))
+                        elif label == 'Studio: ' and details['studio'] is None:
+                            details['studio'] = self.first_text(LABEL_LINK_NODES(node))
+                elif tag == 'img':
+                    actor_name = node.get('title')
+                    if actor_name:
+                        details['cast'].append((actor_name, PerformerPhoto(actor_name, node.get('src'))))
+                elif tag == 'h1':
+                    if details['title'] is None:
+                        details['title'] = node.text_content().strip()
+                elif tag == 'h2':
+                    if details['tagline'] is None:
+                        details['tagline'] = self.first_text(TEXT_NODES(node))
+                elif tag == 'span':
+                    if details['rating'] is None:
+                        details['rating'] = self.first_text(TEXT_NODES(node))
+                elif tag == 'p':
+                    if details['summary'] is None:
+                        details['summary'] = node.text_content().strip()
+                elif tag == 'link':
+                    if details['poster'] is None:
+                        details['poster'] = node.get('href')
+            except Exception as e:
+                LogDebug('Exception while parsing <{0}> on detail page: {1}', node.tag, e)
+
+        return details
+
+    @Timed('update.tagline')
+    def update_tagline(self, metadata, details):
+        if details['tagline']:
+            metadata.tagline = details['tagline']
+            LogDebug('Tagline Found and Set: {0}', metadata.tagline)
+        else:
+            LogDebug('No tagline element found.')
 
-    def update_summary(self, metadata, info_page):
-        try:
-            summary_elements = info_page.xpath('//div[@class="synopsis-content"]/p')
-            if summary_elements:
-                summary = summary_elements[0].text_content().strip()
-                metadata.summary = summary
-                LogDebug('Summary Found and Set: {0}'.format(summary))
-            else:
-                LogDebug('No summary elements found.')
-        except Exception as e:
-            LogDebug('Exception while parsing summary: {0}'.format(str(e)))
+    @Timed('update.summary')
+    def update_summary(self, metadata, details):
+        if details['summary']:
+            metadata.summary = details['summary']
+            LogDebug('Summary Found and Set: {0}', metadata.summary)
+        else:
+            LogDebug('No summary elements found.')
 
-    def update_content_rating(self, metadata, info_page):
-        try:
-            # Extract content rating
-            rating_element = info_page.xpath("//li[small[text()='Rating: ']]/small/following-sibling::text()")
-            if rating_element:
-                metadata.content_rating = rating_element[0].strip()
-                LogDebug('Content Rating Found: {0}'.format(metadata.content_rating))
-            else:
-                LogDebug('No Content Rating elements found.')
-        except Exception as e:
-            LogDebug('Exception while parsing content rating: {0}'.format(str(e)))
+    @Timed('update.content_rating')
+    def update_content_rating(self, metadata, details):
+        if details['content_rating'] is not None:
+            metadata.content_rating = details['content_rating']
+            LogDebug('Content Rating Found: {0}', metadata.content_rating)
+        else:
+            LogDebug('No Content Rating elements found.')
     
-    def update_studio(self, metadata, info_page):
-        try:
-            studio_element = info_page.xpath("//li[small[text()='Studio: ']]/small/following-sibling::a/text()")
-            if studio_element:
-                metadata.studio = studio_element[0].strip()
-                LogDebug('Studio Found: {0}'.format(metadata.studio))
-            else:
-                LogDebug('No Studio elements found.')
-        except Exception as e:
-            LogDebug('Exception while parsing studio: {0}'.format(str(e)))
+    @Timed('update.studio')
+    def update_studio(self, metadata, details):
+        if details['studio'] is not None:
+            metadata.studio = details['studio']
+            LogDebug('Studio Found: {0}', metadata.studio)
+        else:
+            LogDebug('No Studio elements found.')
     
-    def update_originally_available_at(self, metadata, info_page):
+    @Timed('update.originally_available_at')
+    def update_originally_available_at(self, metadata, details):
         try:
-            release_element = info_page.xpath("//li[small[text()='Released:']]/small/following-sibling::text()")
-            production_year_element = info_page.xpath("//li[small[text()='Production Year:']]/small/following-sibling::text()")
-
             release_date = None
-            if release_element:
-                release_date_str = release_element[0].strip()
+            if details['released'] is not None:
+                release_date_str = details['released']
                 # Try different date formats
                 date_formats = ["%b %d %Y", "%B %d, %Y", "%m/%d/%Y"]
                 for date_format in date_formats:
@@ -421,160 +1662,192 @@ class ADEAgent(Agent.Movies):
                     except ValueError:
                         continue
                 if release_date:
-                    LogDebug('Release date parsed successfully: {0}'.format(release_date.strftime('%Y-%m-%d')))
+                    LogDebug('Release date parsed successfully: {0:%Y-%m-%d}', release_date)
 
                 else:
-                    LogDebug('Failed to parse release date: {0}'.format(release_date_str))
+                    LogDebug('Failed to parse release date: {0}', release_date_str)
                 
 
-            Production_year = None
-            if production_year_element:
+            production_year = None
+            if details['production_year'] is not None:
                 try:
-                    production_year = int(production_year_element[0].strip())
-                    LogDebug('Production year found: {0}'.format(production_year))
+                    production_year = int(details['production_year'])
+                    LogDebug('Production year found: {0}', production_year)
                 except ValueError:
                     LogDebug('Production year is not a valid integer')
             else:
                 LogDebug('No production year found.')
-                production_year = None
 
             if release_date:
-                if production_year and preference['useproductiondate'] and production_year < release_date.year:
+                if production_year and SETTINGS.use_production_date and production_year < release_date.year:
                     metadata.originally_available_at = datetime.datetime(production_year, 1, 1)
-                    LogDebug('Setting originally available at to production year: {0}'.format(metadata.originally_available_at))
+                    LogDebug('Setting originally available at to production year: {0}', metadata.originally_available_at)
                 else:
                     metadata.originally_available_at = release_date
                     metadata.year = metadata.originally_available_at.year
-                    LogDebug('Setting originally available at to release date: {0}'.format(metadata.originally_available_at))
+                    LogDebug('Setting originally available at to release date: {0}', metadata.originally_available_at)
             else:
                 LogDebug('No valid release date available to set as originally available.')
         except Exception as e:
-            LogDebug('Failed to update release date and year: {0}'.format(str(e)))
+            LogDebug('Failed to update release date and year: {0}', e)
 
-    def update_year(self, metadata, info_page):
+    @Timed('update.year')
+    def update_year(self, metadata, details):
         try:
-            production_year_element = info_page.xpath("//li[small[text()='Production Year:']]/small/following-sibling::text()")
-            if production_year_element:
-                production_year = int(production_year_element[0].strip())
-                metadata.year = production_year
-                LogDebug('Production Year Set: {0}'.format(metadata.year))
+            if details['production_year'] is not None:
+                metadata.year = int(details['production_year'])
+                LogDebug('Production Year Set: {0}', metadata.year)
             else:
                 LogDebug('No Production Year elements found.')
         except Exception as e:
-            LogDebug('Exception while parsing production year: {0}'.format(str(e)))
+            LogDebug('Exception while parsing production year: {0}', e)
     
 
-    def update_posters(self, metadata, info_page):
-        try:
-            img_elements = info_page.xpath("//link[@rel='image_src']/@href")
-            if img_elements:
-                thumb_url = img_elements[0]
-                thumb = HTTP.Request(thumb_url)
-                metadata.posters[thumb_url] = Proxy.Preview(thumb.content)
-                LogDebug('Poster Updated with URL: {0}'.format(thumb_url))
+    def images_to_fetch(self, attached, urls, image_index):
+        # Images already attached to the metadata are skipped, or revalidated once IMAGE_REVALIDATE
+        # has passed. Anything else is downloaded unconditionally so it can be attached.
+        fetch_urls = []
+        now = time.time()
+        for url in urls:
+            if url in attached:
+                entry = image_index.get(url)
+                if entry and now - entry['checked'] > IMAGE_REVALIDATE:
+                    fetch_urls.append(url)
+                else:
+                    METRICS.count('images.skipped')
+                    LogDebug('Image already attached, skipping download: {0}', url)
             else:
+                image_index.pop(url, None)
+                fetch_urls.append(url)
+        return fetch_urls
+
+    @Timed('update.posters')
+    def update_posters(self, metadata, poster_urls, images):
+        try:
+            if not poster_urls:
                 LogDebug('No Poster elements found.')
+            for index, thumb_url in enumerate(poster_urls):
+                if thumb_url in images:
+                    metadata.posters[thumb_url] = Proxy.Preview(images[thumb_url], sort_order=index + 1)
+                    LogDebug('Poster Updated with URL: {0}', thumb_url)
+        except Exception as e:
+            LogDebug('Exception while setting poster: {0}', e)
+
+    @Timed('update.art')
+    def update_art(self, metadata, art_urls, images):
+        try:
+            for index, image_url in enumerate(art_urls):
+                if image_url in images:
+                    metadata.art[image_url] = Proxy.Media(images[image_url], sort_order=index + 1)
+                    LogDebug('Added art: {0}', image_url)
         except Exception as e:
-            LogDebug('Exception while setting poster: {0}'.format(str(e)))
+            LogDebug('Exception while setting art: {0}', e)
 
-    def update_cast(self, metadata, info_page):
+    @Timed('update.cast')
+    def update_cast(self, metadata, details):
         try:
             metadata.roles.clear()
-            cast_elements = info_page.xpath('//div[@class="hover-popover-detail"]/img')
-            for element in cast_elements:
-                actor_name = element.get('title')
-                actor_photo_url = element.get('src').replace("h.jpg", ".jpg")
-                if actor_name:
-                    role = metadata.roles.new()
-                    role.name = actor_name
-                    role.photo = actor_photo_url
-                    LogDebug('Added Cast Member: {0}'.format(actor_name))
+            for actor_name, actor_photo_url in details['cast']:
+                role = metadata.roles.new()
+                role.name = actor_name
+                role.photo = actor_photo_url
+                LogDebug('Added Cast Member: {0}', actor_name)
         except Exception as e:
-            LogDebug('Exception while updating cast: {0}'.format(str(e)))
+            LogDebug('Exception while updating cast: {0}', e)
 
-    def update_director(self, metadata, info_page):
+    @Timed('update.director')
+    def update_director(self, metadata, details):
         try:
             metadata.directors.clear()
-            director_elements = info_page.xpath('//a[contains(@label, "Director - details")]/text()')
-            for director_name in director_elements:
-                if director_name:
-                    director = metadata.directors.new()
-                    director.name = director_name.strip()
-                    LogDebug('Added Director: {0}'.format(director_name.strip()))
+            for director_name in details['directors']:
+                director = metadata.directors.new()
+                director.name = director_name
+                LogDebug('Added Director: {0}', director_name)
         except Exception as e:
-            LogDebug('Exception while updating director: {0}'.format(str(e)))
+            LogDebug('Exception while updating director: {0}', e)
 
-    def update_genres(self, metadata, info_page):
+    @Timed('update.genres')
+    def update_genres(self, metadata, details):
         try:
             metadata.genres.clear()
-            genre_elements = info_page.xpath('//ul[@class="list-unstyled m-b-2"]//a[@label="Category"]/text()')
-            for genre in genre_elements:
-                genre = genre.strip()
-                if genre and genre.lower() not in [x.lower() for x in preference['ignoregenres'].split('|')]:
+            ignore_genres = SETTINGS.ignore_genres
+            for genre in details['genres']:
+                if genre.lower() not in ignore_genres:
                     metadata.genres.add(genre)
-                    LogDebug('Added Genre: {0}'.format(genre))
+                    LogDebug('Added Genre: {0}', genre)
         except Exception as e:
-            LogDebug('Exception while updating genres: {0}'.format(str(e)))
+            LogDebug('Exception while updating genres: {0}', e)
 
-    def update_rating(self, metadata, info_page):
+    @Timed('update.rating')
+    def update_rating(self, metadata, details):
         try:
-            rating_elements = info_page.xpath('//span[@class="rating-stars-avg"]/text()')
-            if rating_elements:
-                rating = float(rating_elements[0].strip()) * 2
+            if details['rating']:
+                rating = float(details['rating']) * 2
                 metadata.rating = rating
-                LogDebug('Updated Rating to: {0}'.format(rating))
+                LogDebug('Updated Rating to: {0}', rating)
             else:
                 metadata.rating = None
                 LogDebug('No rating found.')
         except Exception as e:
-            LogDebug('Exception while updating rating: {0}'.format(str(e)))
+            LogDebug('Exception while updating rating: {0}', e)
 
-    def retrieve_screenshots(self, metadata, info_page):
+    @Timed('update.screenshots')
+    def retrieve_screenshots(self, details, ade_id):
+        # Returns the screenshot URLs to download
         try:
-            imgs = info_page.xpath('//a[contains(@rel, "scenescreenshots")]')
-            pullscreenscount = int(Prefs['pullscreenscount'])
+            imgs = details['screenshots']
+            pullscreenscount = SETTINGS.screens_count
             if imgs and pullscreenscount > 0:
-                selected_imgs = random.sample(imgs, min(pullscreenscount, len(imgs)))
-                for img in selected_imgs:
-                    thumb_url = img.attrib['href']
-                    thumb = HTTP.Request(thumb_url)
-                    metadata.art[thumb_url] = Proxy.Media(thumb)
-                    LogDebug('Added screenshot: {0}'.format(thumb_url))
+                selected_imgs = SelectImages(imgs, pullscreenscount, '{0}-screenshots'.format(ade_id))
+                LogDebug('Selected screenshots: {0}', selected_imgs)
+                return selected_imgs
         except Exception as e:
-            LogDebug('Exception while retrieving screenshots: {0}'.format(str(e)))
+            LogDebug('Exception while retrieving screenshots: {0}', e)
+        return []
 
-    def retrieve_gallery_images(self, metadata, base_url):
+    @Timed('update.gallery')
+    def retrieve_gallery_images(self, details, base_url, ade_id):
+        # Returns the gallery image URLs to download. The gallery page is only fetched on first use,
+        # and only for titles whose detail page links one that has not turned out empty before.
         try:
-            gallery = HTML.ElementFromURL(base_url + '/gallery')
-            imgs = gallery.xpath('//div/a[contains(@class, "thumb fancy")]')
-            pullgallerycount = int(Prefs['pullgallerycount'])
+            if details['gallery'] is None and NO_GALLERY.get(ade_id):
+                LogDebug('No gallery found for ID {0} before, not fetching it.', ade_id)
+                details['gallery'] = []
+            if details['gallery'] is None:
+                try:
+                    gallery = FetchPage(base_url + '/gallery')
+                    details['gallery'] = [img.attrib['href'] for img in GALLERY_IMAGES(gallery)]
+                except urllib2.HTTPError as e:
+                    if e.code != 404:
+                        raise
+                    details['gallery'] = []
+                LogDebug('Gallery page retrieved with {0} images.', len(details['gallery']))
+                if not details['gallery']:
+                    NO_GALLERY.set(ade_id, True)
+            imgs = details['gallery']
+            pullgallerycount = SETTINGS.gallery_count
             if imgs and pullgallerycount > 0:
-                selected_imgs = random.sample(imgs, min(pullgallerycount, len(imgs)))
-                for img in selected_imgs:
-                    image_url = img.attrib['href']
-                    image = HTTP.Request(image_url)
-                    metadata.art[image_url] = Proxy.Media(image)
-                    LogDebug('Added gallery image: {0}'.format(image_url))
+                selected_imgs = SelectImages(imgs, pullgallerycount, '{0}-gallery'.format(ade_id))
+                LogDebug('Selected gallery images: {0}', selected_imgs)
+                return selected_imgs
         except Exception as e:
-            LogDebug('Exception while retrieving gallery images: {0}'.format(str(e)))
+            LogDebug('Exception while retrieving gallery images: {0}', e)
+        return []
 
-    def update_collections(self, metadata, html, studio):
+    @Timed('update.collections')
+    def update_collections(self, metadata, details, studio):
         try:
             metadata.collections.clear()  # Clears existing collections to avoid duplicates
 
             # Handle Series as Collection
-            series_links = html.xpath('//a[contains(@label, "Series")]')
-            if series_links:
-                series = HTML.StringFromElement(series_links[0])  # Assuming the first link is the correct one
-                series_name = HTML.ElementFromString(series).text_content().strip()
-                series_name = series_name.split('"')[1]  # Parsing might vary based on actual HTML structure
-                metadata.collections.add(series_name)
-                LogDebug('Added Series to collections: {0}'.format(series_name))
+            if details['series']:
+                metadata.collections.add(details['series'])
+                LogDebug('Added Series to collections: {0}', details['series'])
 
             # Handle Studio as Collection based on Preference
-            if Prefs['studioascollection'] and studio:
+            if SETTINGS.studio_as_collection and studio:
                 metadata.collections.add(studio)
-                LogDebug('Added Studio to collections as per user preference: {0}'.format(studio))
+                LogDebug('Added Studio to collections as per user preference: {0}', studio)
 
         except Exception as e:
-            LogDebug('Exception while updating collections: {0}'.format(str(e)))
+            LogDebug('Exception while updating collections: {0}', e)
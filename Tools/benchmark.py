@@ -0,0 +1,467 @@
+"""
+Offline benchmarks for the agent's CPU-bound code paths
+
+Loads Contents/Code/__init__.py through plexshim and times parts of it with no network access.
+
+    replay     Runs search() for every file in <fixtures>/library.txt and update() for every detail
+               page in <fixtures>/movies, with pages served in-process from a fixtures folder laid
+               out as described in fixtureserver.py and caches turned off. Files in
+               <fixtures>/split.txt are searched with splitsearch on, from the per-format pages
+               under <fixtures>/search/<type>. Reports items per second,
+               p50/p95 latency and peak memory allocated per item for each phase, and compares the
+               search results and metadata with <fixtures>/expected.json, exiting with status 1 when
+               they differ. Use --update-expected after an intended change to the extracted data.
+    logging    Cost of the agent's debug logging with debug off: records the LogDebug calls made by
+               search() for every file in <fixtures>/library.txt, search pages parsed and scored,
+               then times them with lazy formatting and with the message formatted at the call site.
+    patterns   Per-file cost of the agent's regexes and XPaths over a scan: for every file, the file
+               name patterns plus the search row XPaths over a saved search page, run once through
+               the compiled objects in the agent's pattern registry and once from their source
+               strings, which is how they were evaluated before the registry.
+    details    Detail page extraction over every saved page in <fixtures>/movies: parse_details(), one
+               pass over DETAIL_NODES, against the document-wide XPath per field the update methods
+               ran before it (BaselineDetailFields). Pages are parsed into trees up front, so only
+               the extraction is timed.
+    scoring    score_candidates() over a large list of search rows, taken from every saved search page
+               in <fixtures>/search, for the title of each file in <fixtures>/library.txt. Reports the
+               time and peak memory allocated per search. --agent runs it against another copy of
+               __init__.py, e.g. one from an earlier revision saved with git show, for comparison.
+
+Usage:
+    python benchmark.py replay [--fixtures DIR] [--iterations 5] [--update-expected]
+    python benchmark.py logging [--repeat 2000] [--fixtures DIR]
+    python benchmark.py patterns [--files 10000] [--fixtures DIR]
+    python benchmark.py details [--repeat 200] [--fixtures DIR]
+    python benchmark.py scoring [--rows 1000] [--repeat 10] [--fixtures DIR] [--agent FILE]
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2: allocations are not reported
+
+import bulkimport
+import fixtureserver
+import plexshim
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+# Every search and update does its full work: nothing is served from the agent's caches, and
+# every optional field (cast, screens, gallery, collections) is extracted and checked
+REPLAY_PREFS = {
+    'cachedays': '0',
+    'searchcachehours': '0',
+    'localmatch': 'false',
+    'skipunchanged': 'false',
+    'requestrate': '0',
+    'metricsinterval': '0',
+    'pullscreens': 'true',
+    'pullgallery': 'true',
+    'imageselection': 'stable',
+    'studioascollection': 'true',
+}
+
+
+def LoadAgent(prefs=None, http=None):
+    # A throwaway data folder, so cached pages from earlier runs never skew the timings
+    data_dir = tempfile.mkdtemp(prefix='adebench')
+    atexit.register(shutil.rmtree, data_dir, True)
+    return plexshim.LoadAgent(data_dir, prefs, http=http, log=lambda message, *args: None)
+
+
+class ReplayHTTP(plexshim.HTTPKit):
+    """HTTP.Request answered from a fixtures folder in-process; images get placeholder bytes."""
+
+    def __init__(self, root):
+        plexshim.HTTPKit.__init__(self)
+        self.root = root
+        self.pages = {}
+
+    def Request(self, url, values=None, headers=None, cacheTime=None, timeout=None, immediate=False, **kwargs):
+        with self.lock:
+            self.requests += 1
+        if url.startswith(plexshim.ADE_BASEURL):
+            path = fixtureserver.FixtureFile(self.root, url[len(plexshim.ADE_BASEURL):])
+            if path is None:
+                raise plexshim.urllib2.HTTPError(url, 404, 'Not Found', {}, None)
+            if path not in self.pages:
+                with open(path, 'rb') as f:
+                    self.pages[path] = f.read()
+            content = self.pages[path]
+        else:
+            content = ('image ' + url).encode('utf-8')
+        with self.lock:
+            self.bytes += len(content)
+        return plexshim.Response(content, {'ETag': '"{0}"'.format(hashlib.md5(content).hexdigest())})
+
+
+def ReplayItems(fixtures):
+    # (phase, name, function) for each search and update; function returns the record to check
+    items = []
+    names = {}  # ADE id -> result name from the searches, which Plex hands update() as media.title
+    for phase, library in (('search', 'library.txt'), ('split', 'split.txt')):
+        if not os.path.exists(os.path.join(fixtures, library)):
+            continue
+        with open(os.path.join(fixtures, library)) as f:
+            for path in (line.strip() for line in f):
+                if path:
+                    items.append((phase, path, lambda agent, path=path: SearchRecord(agent, path, names)))
+    movies = os.path.join(fixtures, 'movies')
+    for name in sorted(os.listdir(movies)):
+        ade_id = name[:-len('.html')]
+        if name.endswith('.html') and ade_id.isdigit():
+            items.append(('update', ade_id, lambda agent, ade_id=ade_id: UpdateRecord(agent, ade_id, names.get(ade_id, ade_id))))
+    return items
+
+
+def SearchRecord(agent, path, names):
+    results = plexshim.SearchResults()
+    agent.search(results, bulkimport.MediaForFile(path), 'en')
+    for result in results:
+        names.setdefault(result.id, result.name)
+    return [[result.id, result.name, result.score] for result in results]
+
+
+def UpdateRecord(agent, ade_id, title):
+    metadata = plexshim.Metadata(ade_id)
+    agent.update(metadata, plexshim.Media(title, title, None), 'en')
+    return {
+        'title': metadata.title,
+        'tagline': metadata.tagline,
+        'summary': metadata.summary,
+        'content_rating': metadata.content_rating,
+        'studio': metadata.studio,
+        'originally_available_at': str(metadata.originally_available_at) if metadata.originally_available_at else None,
+        'year': metadata.year,
+        'rating': metadata.rating,
+        'roles': [[role.name, role.photo] for role in metadata.roles],
+        'directors': [director.name for director in metadata.directors],
+        'genres': sorted(metadata.genres),
+        'collections': sorted(metadata.collections),
+        'posters': sorted(metadata.posters),
+        'art': sorted(metadata.art),
+    }
+
+
+def FormatRecords(records):
+    # JSON with one line per record, so a changed record shows up as a one-line diff
+    phases = []
+    for phase in sorted(records):
+        lines = ['    {0}: {1}'.format(json.dumps(name), json.dumps(records[phase][name], sort_keys=True)) for name in sorted(records[phase])]
+        phases.append('  {0}: {{\n{1}\n  }}'.format(json.dumps(phase), ',\n'.join(lines)))
+    return '{\n' + ',\n'.join(phases) + '\n}\n'
+
+
+def Percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+def BenchReplay(args):
+    http = ReplayHTTP(args.fixtures)
+    agent = LoadAgent(REPLAY_PREFS, http)['ADEAgent']()
+    agents = {'search': agent, 'update': agent, 'split': LoadAgent(dict(REPLAY_PREFS, splitsearch='true'), http)['ADEAgent']()}
+    items = ReplayItems(args.fixtures)
+
+    # One untimed pass warms the page cache and produces the records to check
+    records = dict((phase, {}) for phase, name, function in items)
+    for phase, name, function in items:
+        records[phase][name] = function(agents[phase])
+
+    latencies = dict((phase, []) for phase, name, function in items)
+    started = time.time()
+    for i in range(args.iterations):
+        for phase, name, function in items:
+            item_started = time.time()
+            function(agents[phase])
+            latencies[phase].append(time.time() - item_started)
+    elapsed = time.time() - started
+
+    allocated = dict((phase, []) for phase in latencies)
+    if tracemalloc:
+        tracemalloc.start()
+        for phase, name, function in items:
+            tracemalloc.clear_traces()
+            baseline = tracemalloc.get_traced_memory()[0]
+            function(agents[phase])
+            allocated[phase].append(tracemalloc.get_traced_memory()[1] - baseline)
+        tracemalloc.stop()
+
+    print('{0} items x {1} iterations in {2:.2f}s, {3:.1f} items/s, {4} requests'.format(
+        len(items), args.iterations, elapsed, len(items) * args.iterations / elapsed, http.requests))
+    for phase in sorted(latencies):
+        times = latencies[phase]
+        memory = '{0:.0f} KiB'.format(sum(allocated[phase]) / 1024.0 / len(allocated[phase])) if allocated[phase] else 'n/a'
+        print('{0:<8} {1:>8.1f} items/s  p50 {2:>7.2f} ms  p95 {3:>7.2f} ms  peak allocated {4}/item'.format(
+            phase, len(times) / sum(times), Percentile(times, 50) * 1000, Percentile(times, 95) * 1000, memory))
+
+    expected_path = os.path.join(args.fixtures, 'expected.json')
+    records = json.loads(json.dumps(records))  # Compare as JSON types, e.g. tuples as lists
+    if args.update_expected:
+        with open(expected_path, 'w') as f:
+            f.write(FormatRecords(records))
+        print('Wrote {0}'.format(expected_path))
+        return 0
+    if not os.path.exists(expected_path):
+        print('No expected.json in {0}, nothing to compare'.format(args.fixtures))
+        return 0
+    with open(expected_path) as f:
+        expected = json.load(f)
+    differences = 0
+    for phase in sorted(set(expected) | set(records)):
+        for name in sorted(set(expected.get(phase, {})) | set(records.get(phase, {}))):
+            if expected.get(phase, {}).get(name) != records.get(phase, {}).get(name):
+                differences += 1
+                print('Changed {0} {1}:\n  expected {2}\n  got      {3}'.format(
+                    phase, name, expected.get(phase, {}).get(name), records.get(phase, {}).get(name)))
+    print('Extraction matches expected.json' if not differences else '{0} records differ from expected.json'.format(differences))
+    return 1 if differences else 0
+
+
+def BenchLogging(args):
+    prefs = dict(REPLAY_PREFS, debug='false')
+    namespace = LoadAgent(prefs, ReplayHTTP(args.fixtures))
+    agent = namespace['ADEAgent']()
+    logdebug = namespace['LogDebug']
+    calls = []
+
+    # Record the debug messages full searches log, saved search pages parsed and scored, then
+    # time replaying them through LogDebug: once lazily, as the agent calls it, and once formatted
+    # at the call site, as it used to be called
+    namespace['LogDebug'] = lambda message, *a: calls.append((message, a))
+    searches = 0
+    with open(os.path.join(args.fixtures, 'library.txt')) as f:
+        for path in (line.strip() for line in f):
+            if path:
+                agent.search(plexshim.SearchResults(), bulkimport.MediaForFile(path), 'en')
+                searches += 1
+    namespace['LogDebug'] = logdebug
+
+    def lazy():
+        for message, a in calls:
+            logdebug(message, *a)
+
+    def eager():
+        for message, a in calls:
+            logdebug(message.format(*a))
+
+    def best(function):
+        return min(timeit.repeat(function, number=args.repeat, repeat=5)) / args.repeat / max(searches, 1)
+
+    lazy_time, eager_time = best(lazy), best(eager)
+    per_search = len(calls) / float(max(searches, 1))
+    print('searches                   {0}'.format(searches))
+    print('LogDebug calls per search  {0:.1f}'.format(per_search))
+    print('lazy formatting            {0:.1f} us per search ({1:.0f} ns per call)'.format(lazy_time * 1e6, lazy_time * 1e9 / max(per_search, 1)))
+    print('formatted at the call site {0:.1f} us per search ({1:.0f} ns per call)'.format(eager_time * 1e6, eager_time * 1e9 / max(per_search, 1)))
+
+
+def BenchPatterns(args):
+    namespace = LoadAgent({'debug': 'false'})
+    search = os.path.join(args.fixtures, 'search')
+    with open(os.path.join(search, sorted(os.listdir(search))[0]), 'rb') as f:
+        page = namespace['HTML'].ElementFromString(f.read())
+    files = ['C:\\Movies\\Title {0} (20{1:02d}){2}.mp4'.format(i, i % 24, ' {ade-1528431}' if i % 50 == 0 else '')
+             for i in range(args.files)]
+    names = [namespace[name] for name in ('SPECIAL_TAG', 'TITLE_YEAR', 'TRAILING_YEAR', 'YEAR')]
+    rows = [namespace[name] for name in ('ROW_TITLE', 'ROW_DVD', 'ROW_PRODUCTION_YEAR', 'ROW_RELEASE_YEAR')]
+    search_rows = namespace['SEARCH_ROWS']
+
+    def compiled():
+        special_tag, title_year, trailing_year, year = names
+        for path in files:
+            special_tag.findall(path)
+            match = title_year.search(path)
+            trailing_year.sub('', match.group(1) + ' (2001)')
+            for row in search_rows(page):
+                for xpath in rows:
+                    xpath(row)
+                year.search('(2001)')
+                year.search('2002')
+
+    def strings():
+        special_tag, title_year, trailing_year, year = [pattern.pattern for pattern in names]
+        for path in files:
+            re.findall(special_tag, path)
+            match = re.search(title_year, path)
+            re.sub(trailing_year, '', match.group(1) + ' (2001)')
+            for row in page.xpath(search_rows.path):
+                for xpath in rows:
+                    row.xpath(xpath.path)
+                re.search(year, '(2001)')
+                re.search(year, '2002')
+
+    compiled_time = min(timeit.repeat(compiled, number=1, repeat=3))
+    strings_time = min(timeit.repeat(strings, number=1, repeat=3))
+    print('{0} files, {1} search rows each'.format(args.files, len(search_rows(page))))
+    print('compiled registry   {0:.2f}s, {1:.0f} us per file'.format(compiled_time, compiled_time * 1e6 / args.files))
+    print('source strings      {0:.2f}s, {1:.0f} us per file'.format(strings_time, strings_time * 1e6 / args.files))
+    print('saved               {0:.2f}s, {1:.0f} us per file'.format(strings_time - compiled_time, (strings_time - compiled_time) * 1e6 / args.files))
+
+
+def BaselineDetailFields(page):
+    # The fields update() read before parse_details(), each with its own document-wide XPath as
+    # in the update_* methods of the baseline revision
+    text = lambda values: values[0].strip() if values else None
+    fields = {
+        'tagline': text(page.xpath('//h2[contains(@class, "test")]/text()')),
+        'rating': text(page.xpath('//span[@class="rating-stars-avg"]/text()')),
+        'content_rating': text(page.xpath("//li[small[text()='Rating: ']]/small/following-sibling::text()")),
+        'studio': text(page.xpath("//li[small[text()='Studio: ']]/small/following-sibling::a/text()")),
+        'released': text(page.xpath("//li[small[text()='Released:']]/small/following-sibling::text()")),
+        'production_year': text(page.xpath("//li[small[text()='Production Year:']]/small/following-sibling::text()")),
+        'poster': (page.xpath("//link[@rel='image_src']/@href") or [None])[0],
+        'cast': [(element.get('title'), element.get('src')) for element in page.xpath('//div[@class="hover-popover-detail"]/img')],
+        'directors': [name.strip() for name in page.xpath('//a[contains(@label, "Director - details")]/text()') if name.strip()],
+        'genres': [genre.strip() for genre in page.xpath('//ul[@class="list-unstyled m-b-2"]//a[@label="Category"]/text()')],
+        'screenshots': [element.get('href') for element in page.xpath('//a[contains(@rel, "scenescreenshots")]')],
+        'series': [element.text_content() for element in page.xpath('//a[contains(@label, "Series")]')],
+    }
+    summary = page.xpath('//div[@class="synopsis-content"]/p')
+    fields['summary'] = summary[0].text_content().strip() if summary else None
+    page.xpath("//li[small[text()='Production Year:']]/small/following-sibling::text()")  # update_year ran it again
+    return fields
+
+
+def BenchDetails(args):
+    namespace = LoadAgent({'debug': 'false'})
+    agent = namespace['ADEAgent']()
+    movies = os.path.join(args.fixtures, 'movies')
+    pages = []
+    for name in sorted(os.listdir(movies)):
+        if name.endswith('.html') and name[:-len('.html')].isdigit():
+            with open(os.path.join(movies, name), 'rb') as f:
+                pages.append(namespace['HTML'].ElementFromString(f.read()))
+    if not pages:
+        print('No detail pages in {0}'.format(movies))
+        return 1
+
+    # Both read the same values, so the timings compare like with like
+    for page in pages:
+        details, baseline = agent.parse_details(page), BaselineDetailFields(page)
+        for field in ('tagline', 'summary', 'content_rating', 'studio', 'directors'):
+            if details[field] != baseline[field]:
+                print('{0} differs: {1!r} against {2!r}'.format(field, details[field], baseline[field]))
+
+    def single_pass():
+        for page in pages:
+            agent.parse_details(page)
+
+    def per_field():
+        for page in pages:
+            BaselineDetailFields(page)
+
+    single_time = min(timeit.repeat(single_pass, number=args.repeat, repeat=3)) / args.repeat / len(pages)
+    field_time = min(timeit.repeat(per_field, number=args.repeat, repeat=3)) / args.repeat / len(pages)
+    print('{0} detail pages'.format(len(pages)))
+    print('parse_details        {0:.0f} us per page'.format(single_time * 1e6))
+    print('XPath per field      {0:.0f} us per page'.format(field_time * 1e6))
+    print('speedup              {0:.1f}x'.format(field_time / single_time))
+
+
+def SavedSearchRows(agent, fixtures):
+    # Every row of every saved search page, parsed the way a live search parses them
+    rows = []
+    for directory, dirs, names in sorted(os.walk(os.path.join(fixtures, 'search'))):
+        for name in sorted(names):
+            with open(os.path.join(directory, name), 'rb') as f:
+                rows.extend(agent.parse_search_page(f.read(), 1, None)['rows'])
+    return rows
+
+
+def BenchScoring(args):
+    if args.agent:
+        plexshim.AGENT_CODE = os.path.abspath(args.agent)
+    namespace = LoadAgent({'debug': 'false'})
+    agent = namespace['ADEAgent']()
+
+    # The saved rows repeated up to --rows with ids of their own, like one very long results page
+    saved = SavedSearchRows(namespace['ADEAgent'](), args.fixtures)
+    rows = []
+    while len(rows) < args.rows:
+        for title, ade_id, movie_format, production_year, release_year in saved[:args.rows - len(rows)]:
+            rows.append((title, str(int(ade_id) + 10000000 * (len(rows) // len(saved))), movie_format, production_year, release_year))
+    queries = []
+    with open(os.path.join(args.fixtures, 'library.txt')) as f:
+        for path in (line.strip() for line in f):
+            if path:
+                media = bulkimport.MediaForFile(path)
+                title = media.name[4:] + ', The' if media.name.lower().startswith('the ') else media.name
+                queries.append((title, media.year))
+
+    # Searches with a good match only keep those rows; the others score every row exactly, which
+    # Util.LevenshteinDistance dominates, so the two are reported apart
+    kinds = {}
+    for title, year in queries:
+        matches, good = agent.score_candidates(rows, title, year, None, 'en')
+        kinds.setdefault('good match' if good else 'no good match', []).append((title, year))
+
+    print('{0} rows per search ({1} saved rows), {2}'.format(len(rows), len(saved), plexshim.AGENT_CODE))
+    for kind in sorted(kinds):
+        searches = kinds[kind]
+
+        def search():
+            for title, year in searches:
+                agent.score_candidates(rows, title, year, None, 'en')
+
+        search_time = min(timeit.repeat(search, number=1, repeat=args.repeat)) / len(searches)
+        memory = 'n/a'
+        if tracemalloc:
+            peaks = []
+            tracemalloc.start()
+            for title, year in searches:
+                tracemalloc.clear_traces()
+                baseline = tracemalloc.get_traced_memory()[0]
+                agent.score_candidates(rows, title, year, None, 'en')
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            tracemalloc.stop()
+            memory = '{0:.0f} KiB'.format(sum(peaks) / 1024.0 / len(peaks))
+        print('{0:<14} {1} searches  {2:>8.2f} ms per search  peak allocated {3} per search'.format(
+            kind, len(searches), search_time * 1000, memory))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the agent.')
+    commands = parser.add_subparsers(dest='command')
+    replay = commands.add_parser('replay', help='search and update over saved pages, checked against expected.json')
+    replay.add_argument('--fixtures', default=FIXTURES, help='fixtures folder (default Tools/fixtures)')
+    replay.add_argument('--iterations', type=int, default=5, help='timed passes over all items (default 5)')
+    replay.add_argument('--update-expected', action='store_true', help='write the current results to expected.json')
+    replay.set_defaults(run=BenchReplay)
+    logging = commands.add_parser('logging', help='cost of debug logging with debug off')
+    logging.add_argument('--repeat', type=int, default=2000, help='replays of the recorded calls per timing run (default 2000)')
+    logging.add_argument('--fixtures', default=FIXTURES, help='fixtures folder with saved search pages (default Tools/fixtures)')
+    logging.set_defaults(run=BenchLogging)
+    patterns = commands.add_parser('patterns', help='compiled pattern registry against source strings')
+    patterns.add_argument('--files', type=int, default=10000, help='files in the simulated scan (default 10000)')
+    patterns.add_argument('--fixtures', default=FIXTURES, help='fixtures folder with a saved search page (default Tools/fixtures)')
+    patterns.set_defaults(run=BenchPatterns)
+    details = commands.add_parser('details', help='detail page extraction against the XPath per field it replaced')
+    details.add_argument('--repeat', type=int, default=200, help='passes over the pages per timing run (default 200)')
+    details.add_argument('--fixtures', default=FIXTURES, help='fixtures folder with saved detail pages (default Tools/fixtures)')
+    details.set_defaults(run=BenchDetails)
+    scoring = commands.add_parser('scoring', help='scoring of search rows over a large results list')
+    scoring.add_argument('--rows', type=int, default=1000, help='search rows per search (default 1000)')
+    scoring.add_argument('--repeat', type=int, default=10, help='timing runs, the best is reported (default 10)')
+    scoring.add_argument('--fixtures', default=FIXTURES, help='fixtures folder with saved search pages (default Tools/fixtures)')
+    scoring.add_argument('--agent', help="agent __init__.py to benchmark instead of the bundle's")
+    scoring.set_defaults(run=BenchScoring)
+    args = parser.parse_args(argv)
+    if not getattr(args, 'run', None):
+        parser.error('choose a benchmark')
+    return args.run(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
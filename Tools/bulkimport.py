@@ -0,0 +1,139 @@
+"""
+Offline bulk import: resolve a whole library against ADE ahead of the first Plex scan
+
+Runs the agent's own search, scoring and detail page parsing (Contents/Code/__init__.py, loaded
+through plexshim) over a manifest of file paths or a directory walk, on a bounded pool of worker
+threads. Search rows and parsed detail pages are written into the agent's on-disk caches, so the
+following Plex scan is served almost entirely from cache.
+
+Point --data-dir at the agent's data folder inside Plex's "Plug-in Support/Data" directory, e.g.
+on Linux:
+
+    /var/lib/plexmediaserver/Library/Application Support/Plex Media Server/Plug-in Support/Data/com.plexapp.agents.adultdvdempire
+
+One tab-separated line is printed per file: path, ADE id, score and matched name (id and name are
+empty when nothing reached the agent's good score).
+
+Usage:
+    python bulkimport.py --data-dir DIR [--manifest FILE] [--workers 4] [--pref id=value ...] [PATH ...]
+
+To try it offline, run fixtureserver.py and pass --base-url http://127.0.0.1:8008.
+"""
+
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+
+try:
+    from Queue import Queue, Empty
+    from urllib import quote
+except ImportError:
+    from queue import Queue, Empty
+    from urllib.parse import quote
+
+import plexshim
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.m4v', '.mov', '.wmv', '.mpg', '.mpeg', '.ts', '.flv', '.webm')
+# Title (Year) - cd1 {tag}.ext, everything but the title optional
+FILE_NAME = re.compile(r'^(.*?)(?:\s*\((\d{4})\))?(?:\s*-\s*(?:cd|disc|disk|dvd|part|pt)\d+)?(?:\s*\{[^}]*\})?\.[^.]+$', re.IGNORECASE)
+
+
+def ListFiles(paths, manifest):
+    files = []
+    if manifest:
+        with open(manifest) as f:
+            files.extend(line.strip() for line in f if line.strip())
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.lower().endswith(VIDEO_EXTENSIONS):
+                        files.append(os.path.join(directory, name))
+        else:
+            files.append(path)
+    return files
+
+
+def MediaForFile(path):
+    # Mirrors what Plex hands the agent for an automatic match: cleaned name, year and filename
+    match = FILE_NAME.match(os.path.basename(path))
+    name = match.group(1).strip() if match else os.path.splitext(os.path.basename(path))[0]
+    year = match.group(2) if match else None
+    return plexshim.Media(name, name, quote(path), year)
+
+
+def Resolve(agent, namespace, path):
+    results = plexshim.SearchResults()
+    agent.search(results, MediaForFile(path), 'en')
+    if not results or results[0].score < namespace['SETTINGS'].good_score:
+        return None
+    best = results[0]
+    agent.prime_details(best.id)
+    return best
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Resolve a library against ADE and fill the agent caches.')
+    parser.add_argument('paths', nargs='*', help='media files or folders to walk')
+    parser.add_argument('--manifest', help='file with one media path per line')
+    parser.add_argument('--data-dir', required=True, help="the agent's Plug-in Support data folder")
+    parser.add_argument('--workers', type=int, default=4, help='parallel lookups (default 4)')
+    parser.add_argument('--base-url', help='serve ADE requests from this URL instead, e.g. a fixtureserver')
+    parser.add_argument('--pref', action='append', default=[], metavar='ID=VALUE', help='override an agent preference')
+    args = parser.parse_args(argv)
+
+    files = ListFiles(args.paths, args.manifest)
+    if not files:
+        parser.error('no media files given')
+    prefs = dict(pref.split('=', 1) for pref in args.pref)
+    namespace = plexshim.LoadAgent(args.data_dir, prefs, base_url=args.base_url)
+    agent = namespace['ADEAgent']()
+
+    queue = Queue()
+    for path in files:
+        queue.put(path)
+    output = threading.Lock()
+    counts = {'matched': 0, 'failed': 0}
+
+    def worker():
+        while True:
+            try:
+                path = queue.get_nowait()
+            except Empty:
+                return
+            try:
+                best = Resolve(agent, namespace, path)
+            except Exception as e:
+                best = None
+                with output:
+                    counts['failed'] += 1
+                    sys.stderr.write('Failed to resolve {0}: {1}\n'.format(path, e))
+            with output:
+                if best is not None:
+                    counts['matched'] += 1
+                    sys.stdout.write('{0}\t{1}\t{2}\t{3}\n'.format(path, best.id, best.score, best.name))
+                else:
+                    sys.stdout.write('{0}\t\t\t\n'.format(path))
+                sys.stdout.flush()
+
+    started = time.time()
+    threads = [threading.Thread(target=worker) for i in range(max(args.workers, 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # The agent saves its title index from a timer that would not fire before this exits
+    namespace['TITLE_INDEX'].save()
+
+    http = namespace['HTTP']
+    sys.stderr.write('{0} files, {1} matched, {2} failed, {3} requests, {4} bytes in {5:.1f}s\n'.format(
+        len(files), counts['matched'], counts['failed'], http.requests, http.bytes, time.time() - started))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,123 @@
+"""
+Local stand-in for adultdvdempire.com that serves saved pages from a fixtures folder
+
+Lets the scripts in this folder, and the agent itself, run against recorded ADE pages with no
+network access. Requests are mapped to files by FixtureFile():
+
+    /<type>/search?...&q=<title>   search/<type>/<slug>.html, falling back to search/<slug>.html
+    ...&page=<n>, n of 2 or more   the same with <slug>-page<n>.html
+    /<id>/                         movies/<id>.html
+    /<id>//gallery                 movies/<id>-gallery.html
+    anything else                  the path itself, relative to the fixtures folder
+
+<slug> is the query lower-cased with every run of characters other than letters and digits
+replaced by '-', e.g. "Cat's Meow" -> cat-s-meow. Responses carry an ETag so conditional requests
+get a 304 back.
+
+Usage: python fixtureserver.py FIXTURES_DIR [--port 8008]
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import threading
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+SEARCH_PATH = re.compile(r'^/([^/]+)/search$')
+MOVIE_PATH = re.compile(r'^/(\d+)/+(gallery)?$')
+
+
+def Slug(query):
+    return re.sub(r'[^a-z0-9]+', '-', query.lower()).strip('-')
+
+
+def FixtureFile(root, url):
+    """Returns the fixture file for a request URL or path, or None when there is no such file."""
+    parsed = urlparse(url)
+    candidates = []
+    search = SEARCH_PATH.match(parsed.path)
+    movie = MOVIE_PATH.match(parsed.path)
+    if search:
+        query = parse_qs(parsed.query)
+        slug = Slug(query.get('q', [''])[0])
+        page = query.get('page', ['1'])[0]
+        if page.isdigit() and int(page) > 1:
+            slug = '{0}-page{1}'.format(slug, int(page))
+        candidates.append(os.path.join(root, 'search', search.group(1), slug + '.html'))
+        candidates.append(os.path.join(root, 'search', slug + '.html'))
+    elif movie:
+        suffix = '-gallery' if movie.group(2) else ''
+        candidates.append(os.path.join(root, 'movies', movie.group(1) + suffix + '.html'))
+    else:
+        candidates.append(os.path.join(root, parsed.path.lstrip('/')))
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    root = '.'
+
+    def do_GET(self):
+        path = FixtureFile(self.root, self.path)
+        if path is None:
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            content = f.read()
+        etag = '"{0}"'.format(hashlib.md5(content).hexdigest())
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html' if path.endswith('.html') else 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def Serve(root, port=0):
+    """Starts a fixture server on a background thread and returns it; server_address has the port."""
+    handler = type('Handler', (FixtureHandler,), {'root': os.path.abspath(root)})
+    server = FixtureServer(('127.0.0.1', port), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Serve saved ADE pages for offline runs.')
+    parser.add_argument('fixtures', help='folder laid out as described in this module')
+    parser.add_argument('--port', type=int, default=8008)
+    args = parser.parse_args(argv)
+    server = Serve(args.fixtures, args.port)
+    sys.stderr.write('Serving {0} at http://127.0.0.1:{1}\n'.format(args.fixtures, server.server_address[1]))
+    try:
+        threading.Event().wait(10 ** 9)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
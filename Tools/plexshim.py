@@ -0,0 +1,350 @@
+"""
+Minimal stand-ins for the Plex framework globals used by Contents/Code/__init__.py
+
+Plex injects HTTP, HTML, Data, Dict, Thread, Prefs and friends into the agent's namespace instead of
+letting it import them. This module provides just enough of each, built on the standard library and
+lxml, to load the agent outside of Plex Media Server so its search, parsing and caching code can be
+driven by the scripts in this folder.
+
+Data items are written the way the framework writes them: one pickled file per item under
+<data_dir>/DataItems. Pointing data_dir at the agent's Plug-in Support data folder therefore lets
+these scripts fill the caches the agent reads. Dict is kept in memory only; the agent adopts Data
+items that are missing from its index on first lookup.
+
+Works with Python 2.7 (as used by Plex) and Python 3. Requires lxml.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import types
+import unicodedata
+
+import lxml.html
+
+try:
+    import urllib2
+    from urllib import quote_plus
+except ImportError:
+    # Python 3: expose the pieces of urllib2 the agent uses under the old module name
+    import urllib.error
+    import urllib.parse
+    import urllib.request
+    from urllib.parse import quote_plus
+    urllib2 = types.ModuleType('urllib2')
+    urllib2.HTTPError = urllib.error.HTTPError
+    urllib2.URLError = urllib.error.URLError
+    urllib2.Request = urllib.request.Request
+    urllib2.urlopen = urllib.request.urlopen
+    urllib2.unquote = urllib.parse.unquote
+    urllib2.quote = urllib.parse.quote
+    sys.modules['urllib2'] = urllib2
+
+BUNDLE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGENT_CODE = os.path.join(BUNDLE, 'Contents', 'Code', '__init__.py')
+DEFAULT_PREFS = os.path.join(BUNDLE, 'Contents', 'DefaultPrefs.json')
+ADE_BASEURL = 'http://www.adultdvdempire.com'
+
+
+def LoadPrefs(overrides=None):
+    # Reads DefaultPrefs.json and converts values the way Plex hands them to the agent
+    prefs = {}
+    with open(DEFAULT_PREFS) as f:
+        for pref in json.load(f):
+            value = pref['default']
+            if pref['type'] == 'bool':
+                value = value == 'true'
+            prefs[pref['id']] = value
+    for key, value in (overrides or {}).items():
+        if isinstance(prefs.get(key), bool) and not isinstance(value, bool):
+            value = value.lower() == 'true'
+        prefs[key] = value
+    return prefs
+
+
+class Response(object):
+    def __init__(self, content, headers):
+        self.content = content
+        self.headers = headers
+
+    def __str__(self):
+        return self.content
+
+
+class HTTPKit(object):
+    """HTTP.Request on top of urllib2, with an optional base URL rewrite for stand-in servers."""
+
+    CacheTime = 0
+
+    def __init__(self, base_url=None, timeout=30):
+        self.Headers = {}
+        self.base_url = base_url
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def rewrite(self, url):
+        if self.base_url and url.startswith(ADE_BASEURL):
+            return self.base_url.rstrip('/') + url[len(ADE_BASEURL):]
+        return url
+
+    def Request(self, url, values=None, headers=None, cacheTime=None, timeout=None, immediate=False, **kwargs):
+        all_headers = dict(self.Headers)
+        all_headers.update(headers or {})
+        request = urllib2.Request(self.rewrite(url), headers=all_headers)
+        response = urllib2.urlopen(request, timeout=timeout or self.timeout)
+        content = response.read()
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(content)
+        return Response(content, dict(response.info().items()))
+
+
+class HTMLKit(object):
+    def __init__(self, http):
+        self.http = http
+
+    def ElementFromURL(self, url, **kwargs):
+        return lxml.html.fromstring(self.http.Request(url).content)
+
+    def ElementFromString(self, string):
+        return lxml.html.fromstring(string)
+
+    def StringFromElement(self, element, **kwargs):
+        return lxml.html.tostring(element, encoding='unicode' if sys.version_info[0] > 2 else None)
+
+
+class DataKit(object):
+    """Data item storage using the framework's on-disk layout: <data_dir>/DataItems/<item>."""
+
+    def __init__(self, data_dir):
+        self.path = os.path.join(data_dir, 'DataItems')
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+    def item_path(self, item):
+        return os.path.join(self.path, item)
+
+    def Exists(self, item):
+        return os.path.exists(self.item_path(item))
+
+    def Load(self, item):
+        with open(self.item_path(item), 'rb') as f:
+            return f.read()
+
+    def Save(self, item, data):
+        temp = self.item_path(item) + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.rename(temp, self.item_path(item))
+
+    def LoadObject(self, item):
+        return pickle.loads(self.Load(item))
+
+    def SaveObject(self, item, obj):
+        self.Save(item, pickle.dumps(obj, 2))
+
+    def Remove(self, item):
+        if self.Exists(item):
+            os.remove(self.item_path(item))
+
+
+class DictKit(dict):
+    def Save(self):
+        pass
+
+
+class ThreadKit(object):
+    def Lock(self, key=None):
+        return threading.RLock()
+
+    def Semaphore(self, key=None, limit=1):
+        return threading.BoundedSemaphore(limit)
+
+    def Event(self, key=None):
+        return threading.Event()
+
+    def Create(self, f, globalize=True, *args, **kwargs):
+        thread = threading.Thread(target=f, args=args, kwargs=kwargs)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def CreateTimer(self, interval, f, globalize=True, *args, **kwargs):
+        timer = threading.Timer(interval, f, args, kwargs)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def Sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class UtilKit(object):
+    def LevenshteinDistance(self, first, second):
+        previous = list(range(len(second) + 1))
+        for i, a in enumerate(first, 1):
+            current = [i]
+            for j, b in enumerate(second, 1):
+                current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
+            previous = current
+        return previous[-1]
+
+
+class StringKit(object):
+    def URLEncode(self, string):
+        if not isinstance(string, str):
+            string = string.encode('utf-8')
+        return quote_plus(string)
+
+    def StripDiacritics(self, string):
+        if isinstance(string, bytes):
+            string = string.decode('utf-8')
+        stripped = ''.join(c for c in unicodedata.normalize('NFKD', string) if not unicodedata.combining(c))
+        return str(stripped) if sys.version_info[0] > 2 else stripped.encode('utf-8')
+
+
+class HashKit(object):
+    def MD5(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return hashlib.md5(data).hexdigest()
+
+    def SHA1(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return hashlib.sha1(data).hexdigest()
+
+
+class JSONKit(object):
+    def StringFromObject(self, obj):
+        return json.dumps(obj)
+
+    def ObjectFromString(self, string):
+        return json.loads(string)
+
+
+class MetadataSearchResult(object):
+    def __init__(self, id, name=None, year=None, score=0, lang=None, thumb=None):
+        self.id = id
+        self.name = name
+        self.year = year
+        self.score = score
+        self.lang = lang
+        self.thumb = thumb
+
+
+class ImageMap(dict):
+    def validate_keys(self, keys):
+        for key in list(self):
+            if key not in keys:
+                del self[key]
+
+
+class Person(object):
+    name = None
+    role = None
+    photo = None
+
+
+class People(list):
+    def new(self):
+        person = Person()
+        self.append(person)
+        return person
+
+
+class Metadata(object):
+    """The fields of a Plex movie metadata object that update() writes."""
+
+    def __init__(self, id):
+        self.id = id
+        self.title = None
+        self.tagline = None
+        self.summary = None
+        self.content_rating = None
+        self.studio = None
+        self.originally_available_at = None
+        self.year = None
+        self.rating = None
+        self.posters = ImageMap()
+        self.art = ImageMap()
+        self.roles = People()
+        self.directors = People()
+        self.genres = set()
+        self.collections = set()
+
+
+class ProxyKit(object):
+    def Preview(self, content, **kwargs):
+        return content
+
+    def Media(self, content, **kwargs):
+        return content
+
+
+class AgentKit(object):
+    Movies = object
+
+
+class LocaleKit(object):
+    class Language(object):
+        English = 'en'
+
+
+class SearchResults(list):
+    def Append(self, result):
+        self.append(result)
+
+    def Sort(self, attr, descending=False):
+        self.sort(key=lambda result: getattr(result, attr), reverse=descending)
+
+
+class Media(object):
+    def __init__(self, name, title, filename, year=None):
+        self.name = name
+        self.title = title
+        self.filename = filename
+        self.year = year
+
+
+def Log(message, *args):
+    sys.stderr.write((message % args if args else message) + '\n')
+
+
+def LoadAgent(data_dir, prefs=None, base_url=None, http=None, log=Log):
+    """
+    Executes the agent's __init__.py in a namespace populated with the stand-ins above and returns
+    that namespace. http may replace the urllib2 based HTTP kit, e.g. with a replay of saved pages.
+    """
+    http = http or HTTPKit(base_url)
+    namespace = {
+        '__name__': 'AdultDVDEmpire',
+        'Prefs': LoadPrefs(prefs),
+        'Log': log,
+        'HTTP': http,
+        'HTML': HTMLKit(http),
+        'Data': DataKit(data_dir),
+        'Dict': DictKit(),
+        'Thread': ThreadKit(),
+        'Util': UtilKit(),
+        'String': StringKit(),
+        'Hash': HashKit(),
+        'JSON': JSONKit(),
+        'MetadataSearchResult': MetadataSearchResult,
+        'Proxy': ProxyKit(),
+        'Agent': AgentKit,
+        'Locale': LocaleKit,
+        'CACHE_1MINUTE': 60,
+        'CACHE_1HOUR': 3600,
+        'CACHE_1DAY': 86400,
+    }
+    with open(AGENT_CODE) as f:
+        code = compile(f.read(), AGENT_CODE, 'exec')
+    exec(code, namespace)
+    return namespace